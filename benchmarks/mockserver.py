@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# This file holds a local http server that stands in for vsco when benchmarking
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BLOCK = bytes(range(256)) * 256
+
+# upload_date of the newest synthetic post, in milliseconds
+NEWEST = 1600000000000
+
+
+def body(start, end):
+    """
+    Generates the bytes of a synthetic media file without keeping it in memory
+    :params: start and end - the first and last byte wanted
+    :return: a generator of byte chunks
+    """
+    while start <= end:
+        offset = start % len(BLOCK)
+        chunk = BLOCK[offset : offset + end + 1 - start]
+        start += len(chunk)
+        yield chunk
+
+
+class Account(object):
+    """
+    A synthetic vsco account, its media is generated from the seed when it's asked for
+
+    :params: name - the username, site_id - its site id, posts - the number of images
+    and videos, collection - the number of collection posts, articles - the number of
+    journal articles, video_share - the share of posts that are videos,
+    image_size and video_size - file sizes in bytes, seed - makes the account repeatable
+    """
+
+    def __init__(
+        self,
+        name,
+        site_id,
+        posts=100,
+        collection=0,
+        articles=0,
+        video_share=0.1,
+        image_size=200 * 1024,
+        video_size=4 * 1024 * 1024,
+        seed=0,
+    ):
+        self.name = name
+        self.site_id = site_id
+        self.collection_id = "c%d" % site_id
+        self.posts = posts
+        self.collection = collection
+        self.articles = articles
+        self.video_share = video_share
+        self.image_size = image_size
+        self.video_size = video_size
+        self.seed = seed
+
+    def isVideo(self, kind, i):
+        draw = random.Random("%s/%s/%d/%d" % (self.name, kind, i, self.seed))
+        return draw.random() < self.video_share
+
+    def media(self, host, kind, i):
+        """
+        Builds one post the way the medias and collection listings return it
+        :params: host - the host:port media is served from, kind - "images" or
+        "collection", i - the position of the post, newest first
+        :return: a dict of the post
+        """
+        name = "%s/%s/%d" % (self.name, kind, i)
+        return {
+            "_id": name,
+            "upload_date": NEWEST - i * 1000,
+            "is_video": self.isVideo(kind, i),
+            "responsive_url": "%s/media/%s.jpg" % (host, name),
+            "video_url": "%s/media/%s.mp4" % (host, name),
+            "width": 2048,
+            "height": 1365,
+        }
+
+    def article(self, host, i):
+        """
+        Builds one journal article with an image, a text block and a video
+        :params: host - the host:port media is served from, i - the position of the article
+        :return: a dict of the article
+        """
+        name = "%s/journal/%d" % (self.name, i)
+        return {
+            "permalink": "article-%d" % i,
+            "body": [
+                {
+                    "type": "image",
+                    "content": [
+                        {
+                            "id": "%s-journal-%d-img" % (self.name, i),
+                            "responsive_url": "%s/media/%s.jpg" % (host, name),
+                        }
+                    ],
+                },
+                {"type": "text", "content": "Article %d of %s" % (i, self.name)},
+                {
+                    "type": "video",
+                    "content": [
+                        {
+                            "id": "%s-journal-%d-vid" % (self.name, i),
+                            "video_url": "%s/media/%s.mp4" % (host, name),
+                        }
+                    ],
+                },
+            ],
+        }
+
+    def size(self, name):
+        return self.video_size if name.endswith(".mp4") else self.image_size
+
+
+class MockServer(object):
+    """
+    Serves synthetic accounts and media files with Range support on a local port
+
+    :params: rate - bytes per second each connection is limited to, 0 for no limit,
+    latency - seconds every response waits before it starts, error_rate - share of
+    requests answered with a 503 and Retry-After: 0, seed - makes the errors repeatable
+    """
+
+    def __init__(self, rate=0, latency=0, error_rate=0, seed=0):
+        self.rate = rate
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.files = {}
+        self.accounts = {}
+        self.sites = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.counts = {"api": 0, "pages": 0, "media": 0, "errors": 0, "bytes": 0}
+        handler = type("Handler", (MediaHandler,), {"mock": self})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.httpd.server_port
+
+    @property
+    def host(self):
+        return "127.0.0.1:%d" % self.httpd.server_port
+
+    def addFile(self, name, size):
+        """
+        Registers a synthetic media file
+        :params: name - the path it is served under, size - its size in bytes
+        :return: the url of the file
+        """
+        self.files[name] = size
+        return "%s/media/%s" % (self.url, name)
+
+    def addAccount(self, name, **kwargs):
+        """
+        Registers a synthetic account, see Account for the options
+        :params: name - the username
+        :return: the Account
+        """
+        account = Account(name, len(self.accounts) + 1, **kwargs)
+        self.accounts[name] = account
+        self.sites[account.site_id] = account
+        return account
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.counts[key] += amount
+
+    def resetCounts(self):
+        with self.lock:
+            for key in self.counts:
+                self.counts[key] = 0
+
+    def fail(self):
+        """
+        Decides if a request gets an injected error
+        :params: none
+        :return: a boolean
+        """
+        if not self.error_rate:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def fileSize(self, name):
+        """
+        Finds the size of a media file, registered with addFile or part of an account
+        :params: name - the path after /media/
+        :return: the size in bytes, or None if there is no such file
+        """
+        if name in self.files:
+            return self.files[name]
+        account = self.accounts.get(name.split("/")[0])
+        if account is None:
+            return None
+        return account.size(name)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    mock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.serveMedia(head=True)
+
+    def do_GET(self):
+        if self.path.startswith("/api/2.0/"):
+            self.serveApi()
+        else:
+            self.serveMedia()
+
+    def sendEmpty(self, status, headers=()):
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def sendJson(self, data):
+        payload = json.dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def serveApi(self):
+        mock = self.mock
+        mock.count("api")
+        if mock.latency:
+            time.sleep(mock.latency)
+        if mock.fail():
+            mock.count("errors")
+            self.sendEmpty(503, [("Retry-After", "0")])
+            return
+        url = urlparse(self.path)
+        path = url.path[len("/api/2.0/") :].strip("/").split("/")
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        page = int(query.get("page", 1))
+        size = int(query.get("size", 30))
+
+        if path == ["sites"]:
+            account = mock.accounts.get(query.get("subdomain"))
+            if account is None:
+                self.sendJson({"sites": []})
+                return
+            self.sendJson(
+                {
+                    "sites": [
+                        {
+                            "id": account.site_id,
+                            "site_collection_id": account.collection_id,
+                        }
+                    ]
+                }
+            )
+            return
+        if len(path) == 2 and path[0] == "sites":
+            account = mock.sites.get(int(path[1]))
+            if account is None:
+                self.sendEmpty(404)
+                return
+            self.sendJson(
+                {
+                    "site": {
+                        "profile_image_id": "%s-profile" % account.name,
+                        "responsive_url": "%s/media/%s/profile.jpg"
+                        % (mock.host, account.name),
+                    }
+                }
+            )
+            return
+
+        account = None
+        if path == ["medias"]:
+            kind, key = "images", "media"
+            account = mock.sites.get(int(query.get("site_id", 0)))
+        elif len(path) == 3 and path[0] == "collections":
+            kind, key = "collection", "medias"
+            account = mock.sites.get(int(path[1][1:] or 0))
+        elif path == ["articles"]:
+            kind, key = "journal", "articles"
+            account = mock.sites.get(int(query.get("site_id", 0)))
+        if account is None:
+            self.sendEmpty(404)
+            return
+        total = {
+            "images": account.posts,
+            "collection": account.collection,
+            "journal": account.articles,
+        }[kind]
+        mock.count("pages")
+        first = (page - 1) * size
+        items = range(first, min(first + size, total))
+        if kind == "journal":
+            found = [account.article(mock.host, i) for i in items]
+        else:
+            found = [account.media(mock.host, kind, i) for i in items]
+        self.sendJson({key: found, "total": total, "page": page, "size": size})
+
+    def serveMedia(self, head=False):
+        mock = self.mock
+        with mock.lock:
+            mock.requests += 1
+        mock.count("media")
+        name = self.path.split("?")[0][len("/media/") :]
+        size = mock.fileSize(name) if self.path.startswith("/media/") else None
+        if size is None:
+            self.sendEmpty(404)
+            return
+        if mock.latency:
+            time.sleep(mock.latency)
+        if mock.fail():
+            mock.count("errors")
+            self.sendEmpty(503, [("Retry-After", "0")])
+            return
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), size - 1)
+            if start >= size:
+                self.sendEmpty(416, [("Content-Range", "bytes */%d" % size)])
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, size))
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end + 1 - start))
+        self.end_headers()
+        if head:
+            return
+        self.sendBody(start, end)
+
+    def sendBody(self, start, end):
+        began = time.monotonic()
+        sent = 0
+        for chunk in body(start, end):
+            for i in range(0, len(chunk), 16384):
+                piece = chunk[i : i + 16384]
+                self.wfile.write(piece)
+                sent += len(piece)
+                if self.mock.rate:
+                    ahead = sent / self.mock.rate - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        self.mock.count("bytes", sent)
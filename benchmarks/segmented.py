@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# Compares single stream and segmented downloads of one large video
+#
+#   python benchmarks/segmented.py --size 256 --rate 16 --segments 1 2 4 8
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mockserver import MockServer, body  # noqa: E402
+from vscoscrape import network  # noqa: E402
+from vscoscrape.download import Downloader  # noqa: E402
+
+
+def run(url, size, segments, chunk_size):
+    """
+    Downloads the file once with the given number of segments
+    :params: url - the file, size - its size, segments - how many ranges, chunk_size - buffer size
+    :return: a dict with the timing of the download
+    """
+    session = network.makeSession(segments)
+    downloader = Downloader(session, chunk_size, segments, 1)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "video.mp4")
+        began = time.monotonic()
+        downloader.fetch(url, path, resumable=True)
+        seconds = time.monotonic() - began
+        with open(path, "rb") as f:
+            ok = all(f.read(len(chunk)) == chunk for chunk in body(0, size - 1))
+    return {
+        "segments": segments,
+        "seconds": round(seconds, 3),
+        "mb_per_s": round(size / seconds / 1024 / 1024, 2),
+        "verified": ok,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compares single stream and segmented downloads"
+    )
+    parser.add_argument("--size", type=int, default=256, help="video size in MiB")
+    parser.add_argument("--rate", type=float, default=16, help="MiB/s per connection")
+    parser.add_argument("--segments", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--bufferSize", type=int, default=1024, help="KiB")
+    parser.add_argument("--output", help="write the results as json to this file")
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    server = MockServer(rate=int(args.rate * 1024 * 1024)).start()
+    url = server.addFile("video.mp4", size)
+    results = [run(url, size, n, args.bufferSize * 1024) for n in args.segments]
+    server.stop()
+
+    for result in results:
+        print(
+            "%2d segments: %7.3fs %8.2f MB/s %s"
+            % (
+                result["segments"],
+                result["seconds"],
+                result["mb_per_s"],
+                "ok" if result["verified"] else "CORRUPT",
+            )
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"size": size, "rate": args.rate, "results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# Measures listing and download throughput of every scrape path against synthetic accounts
+#
+#   python benchmarks/suite.py --users 4 --posts 500 --latency 20 --output results.json
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from mockserver import MockServer  # noqa: E402
+
+PHASES = {
+    "images": "getImages",
+    "collection": "getCollection",
+    "journal": "getJournal",
+    "profile": "getProfile",
+}
+
+
+def peakRss():
+    """
+    Gets the peak resident memory of this process
+    :params: none
+    :return: the size in MiB, or None where the resource module is missing
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def scrape(args):
+    """
+    Runs one scrape path for every synthetic user, in the child process started by measure
+    :params: args - the parsed arguments
+    :return: a dict with the wall time, the peak memory and the scheduler counters
+    """
+    from vscoscrape import constants, network
+    from vscoscrape.download import Downloader
+    from vscoscrape.scheduler import Scheduler
+    from vscoscrape.vscoscrape import Scraper
+
+    constants.api = args.child + "/api/2.0"
+    session = network.makeSession(args.workers * 2)
+    scheduler = Scheduler(args.workers * 2)
+    downloader = Downloader(session, scheduler=scheduler)
+    began = time.monotonic()
+    for i in range(args.users):
+        options = {"folder": args.folder, "scheduler": scheduler}
+        if args.engine == "async":
+            from vscoscrape.asyncengine import AsyncScraper
+
+            scraper = AsyncScraper(
+                "user%d" % i, args.workers * 4, session, downloader, **options
+            )
+        else:
+            scraper = Scraper(
+                "user%d" % i, args.workers, session, downloader, **options
+            )
+        getattr(scraper, PHASES[args.path])()
+    return {
+        "seconds": time.monotonic() - began,
+        "peak_rss_mib": peakRss(),
+        "scheduler": scheduler.summary(),
+    }
+
+
+def measure(server, args, path, engine, folder):
+    """
+    Runs one scrape path in a fresh process, so its peak memory is its own
+    :params: server - the MockServer, args - the parsed arguments, path - the scrape
+    path, engine - "threads" or "async", folder - where the media is saved
+    :return: a dict of throughput numbers
+    """
+    server.resetCounts()
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--child",
+        server.url,
+        "--folder",
+        folder,
+        "--path",
+        path,
+        "--engine",
+        engine,
+        "--users",
+        str(args.users),
+        "--workers",
+        str(args.workers),
+    ]
+    done = subprocess.run(
+        command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+    )
+    child = json.loads(done.stdout.decode("utf-8").splitlines()[-1])
+    seconds = max(child["seconds"], 1e-9)
+    counts = dict(server.counts)
+    return {
+        "seconds": round(seconds, 3),
+        "pages": counts["pages"],
+        "pages_per_s": round(counts["pages"] / seconds, 2),
+        "downloads": counts["media"],
+        "downloads_per_s": round(counts["media"] / seconds, 2),
+        "mb": round(counts["bytes"] / 1024 / 1024, 2),
+        "mb_per_s": round(counts["bytes"] / 1024 / 1024 / seconds, 2),
+        "errors_injected": counts["errors"],
+        "retries": child["scheduler"]["retries"],
+        "failures": child["scheduler"]["failures"],
+        "peak_rss_mib": child["peak_rss_mib"],
+    }
+
+
+def version():
+    """
+    Names the checked out version of the scraper, so results can be compared later
+    :params: none
+    :return: the git description, or None outside a git checkout
+    """
+    try:
+        done = subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=ROOT,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+    except OSError:
+        return None
+    return done.stdout.decode("utf-8").strip() or None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the scrape paths against a local stand-in for vsco"
+    )
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--posts", type=int, default=500, help="images per user")
+    parser.add_argument(
+        "--collection",
+        type=int,
+        default=200,
+        help="collection posts per user",
+    )
+    parser.add_argument(
+        "--articles",
+        type=int,
+        default=20,
+        help="journal articles per user",
+    )
+    parser.add_argument("--videoShare", type=float, default=0.1)
+    parser.add_argument("--imageSize", type=int, default=200, help="KiB")
+    parser.add_argument("--videoSize", type=int, default=4096, help="KiB")
+    parser.add_argument("--latency", type=float, default=0, help="ms per response")
+    parser.add_argument("--errorRate", type=float, default=0, help="share of 503s")
+    parser.add_argument("--rate", type=float, default=0, help="MiB/s per connection")
+    parser.add_argument("--workers", type=int, default=5)
+    parser.add_argument(
+        "--engines",
+        nargs="+",
+        default=["threads", "async"],
+        choices=["threads", "async"],
+    )
+    parser.add_argument(
+        "--paths", nargs="+", default=list(PHASES), choices=list(PHASES)
+    )
+    parser.add_argument("--output", help="write the results as json to this file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--folder", help=argparse.SUPPRESS)
+    parser.add_argument("--path", help=argparse.SUPPRESS)
+    parser.add_argument("--engine", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(scrape(args)))
+        return
+
+    server = MockServer(
+        rate=int(args.rate * 1024 * 1024),
+        latency=args.latency / 1000,
+        error_rate=args.errorRate,
+    ).start()
+    for i in range(args.users):
+        server.addAccount(
+            "user%d" % i,
+            posts=args.posts,
+            collection=args.collection,
+            articles=args.articles,
+            video_share=args.videoShare,
+            image_size=args.imageSize * 1024,
+            video_size=args.videoSize * 1024,
+            seed=i,
+        )
+
+    results = []
+    for engine in args.engines:
+        if engine == "async":
+            try:
+                import aiohttp  # noqa: F401
+            except ImportError:
+                print("Skipping the async engine, aiohttp isn't installed")
+                continue
+        for path in args.paths:
+            with tempfile.TemporaryDirectory() as folder:
+                sync = measure(server, args, path, engine, folder)
+                # The same scrape again finds everything on disk already
+                resync = measure(server, args, path, engine, folder)
+            results.append(
+                {"engine": engine, "path": path, "sync": sync, "resync": resync}
+            )
+            print(
+                "%-7s %-10s %7.2f pages/s %8.2f downloads/s %8.2f MB/s "
+                "%6s MiB peak, re-sync %.3fs"
+                % (
+                    engine,
+                    path,
+                    sync["pages_per_s"],
+                    sync["downloads_per_s"],
+                    sync["mb_per_s"],
+                    sync["peak_rss_mib"],
+                    resync["seconds"],
+                )
+            )
+    server.stop()
+
+    if args.output:
+        config = {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("child", "folder", "path", "engine", "output")
+        }
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "version": version(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "time": int(time.time()),
+                    "config": config,
+                    "results": results,
+                },
+                f,
+                indent=4,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -14,9 +14,13 @@ setup(
         "requests",
         "beautifulsoup4",
     ],
+    extras_require={
+        "async": ["aiohttp"],
+    },
     entry_points="""
         [console_scripts]
         vsco-scraper=vscoscrape:main
+        vsco-manifest=vscoscrape.manifest:main
     """,
     keywords="vsco scrape image images download",
 )
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# This file holds the storage backend that keeps a user's media in size-capped tar shards
+import json
+import os
+import re
+import shutil
+import tarfile
+import threading
+
+SHARD = "shard-%05d.tar"
+INDEX = "shard-%05d.idx"
+# The storage backends a Scraper can save media with
+STORAGES = ("files", "tar")
+
+
+def padded(size):
+    """
+    Rounds a member size up to whole tar blocks
+    :params: size - the size in bytes
+    :return: the bytes the member data takes up in the tar
+    """
+    return -(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+
+
+class TarArchive(object):
+    """
+    Keeps the files of one user in folder/shard-NNNNN.tar, starting the next shard
+    once a file would take the current one past shard_size bytes
+
+    Every shard has an index next to it, shard-NNNNN.idx, with a json line of
+    [name, offset, size] per member, so existence checks and reads seek straight to
+    a member instead of reading the tar. Names are paths relative to folder, the
+    same layout the files backend writes, which tar -x gives back. Members are
+    appended behind the last one the index knows of and their index line is written
+    after the data, so a crash midway leaves bytes the next append writes over.
+    Downloads land on disk first and are moved in by add once they are complete.
+    """
+
+    def __init__(self, folder, shard_size=1024 * 1024 * 1024):
+        self.folder = os.path.abspath(folder)
+        self.shard_size = shard_size
+        self.lock = threading.Lock()
+        # name -> (shard, offset of the data, size)
+        self.members = {}
+        # directory relative to folder -> names of the members in it
+        self.dirs = {}
+        self.shard = 0
+        # Where the next member goes in the current shard
+        self.end = 0
+        if os.path.isdir(self.folder):
+            shards = []
+            for entry in os.listdir(self.folder):
+                match = re.match(r"shard-(\d+)\.idx$", entry)
+                if match:
+                    shards.append(int(match.group(1)))
+            for shard in sorted(shards):
+                self.load(shard)
+
+    def load(self, shard):
+        """
+        Reads the index of a shard, cutting off a line a crash left half written
+        :params: shard - the number of the shard
+        :return: none
+        """
+        path = os.path.join(self.folder, INDEX % shard)
+        end = 0
+        good = 0
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    name, offset, size = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                good += len(line)
+                self.note(name, shard, offset, size)
+                end = max(end, offset + padded(size))
+        if good != os.path.getsize(path):
+            with open(path, "r+b") as f:
+                f.truncate(good)
+        if shard >= self.shard:
+            self.shard = shard
+            self.end = end
+
+    def note(self, name, shard, offset, size):
+        """
+        Remembers where a member is, the caller holds self.lock or is __init__
+        :params: name - the member name, shard - its shard, offset - where its data
+        starts, size - its size in bytes
+        :return: none
+        """
+        self.members[name] = (shard, offset, size)
+        directory, base = os.path.split(name)
+        self.dirs.setdefault(directory or ".", set()).add(base)
+
+    def name(self, path):
+        """
+        Turns a path in the usual layout into a member name
+        :params: path - the path
+        :return: the path relative to folder, with / separators
+        """
+        return os.path.relpath(os.path.abspath(path), self.folder).replace(os.sep, "/")
+
+    def add(self, path):
+        """
+        Moves a finished file into the current shard, replacing a member of the same name
+        :params: path - the file, in the usual layout under folder
+        :return: the size of the file
+        """
+        name = self.name(path)
+        size = os.path.getsize(path)
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mode = 0o644
+        info.mtime = int(os.path.getmtime(path))
+        header = info.tobuf(tarfile.PAX_FORMAT)
+        with self.lock:
+            if self.end and self.end + len(header) + padded(size) > self.shard_size:
+                self.shard += 1
+                self.end = 0
+            tar = os.path.join(self.folder, SHARD % self.shard)
+            with open(tar, "r+b" if os.path.exists(tar) else "wb") as f:
+                f.seek(self.end)
+                f.write(header)
+                offset = f.tell()
+                with open(path, "rb") as src:
+                    shutil.copyfileobj(src, f, 1024 * 1024)
+                f.write(b"\0" * (padded(size) - size))
+                end = f.tell()
+                # Two empty blocks end a tar, the next member writes over them
+                f.write(b"\0" * 2 * tarfile.BLOCKSIZE)
+                f.truncate()
+            with open(os.path.join(self.folder, INDEX % self.shard), "a") as f:
+                f.write(json.dumps([name, offset, size]) + "\n")
+            self.note(name, self.shard, offset, size)
+            self.end = end
+        os.remove(path)
+        return size
+
+    def namesIn(self, path):
+        """
+        Gets the names of the files kept for a directory
+        :params: path - the directory, in the usual layout under folder
+        :return: a set of file names
+        """
+        directory = self.name(path)
+        with self.lock:
+            return set(self.dirs.get(directory, ()))
+
+    def sizeOf(self, path):
+        """
+        Looks up the size of a file
+        :params: path - the file, in the usual layout under folder
+        :return: the size in bytes, or None when it isn't kept
+        """
+        with self.lock:
+            member = self.members.get(self.name(path))
+        return member[2] if member is not None else None
+
+    def read(self, path):
+        """
+        Reads a file back out of its shard
+        :params: path - the file, in the usual layout under folder
+        :return: the bytes of the file
+        """
+        with self.lock:
+            member = self.members.get(self.name(path))
+        if member is None:
+            raise FileNotFoundError(path)
+        shard, offset, size = member
+        with open(os.path.join(self.folder, SHARD % shard), "rb") as f:
+            f.seek(offset)
+            return f.read(size)
@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+# This file holds the asyncio engine, an alternative to the thread pools of Scraper
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from tqdm import tqdm
+
+from . import constants
+from .checkpoint import DONE
+from .checkpoint import LISTED
+from .download import DownloadError
+from .httpcache import cacheKey
+from .mediastore import hashFile
+from .metrics import timedPhase
+from .vscoscrape import Scraper
+from .workqueue import AsyncWorkQueue
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+class AsyncScraper(Scraper):
+    """
+    Does the same work as Scraper, with every request of a run on one event loop
+
+    Listing, caching and the folder layout are shared with Scraper, only the network
+    and disk work is different. concurrency caps the requests in flight at any time.
+    """
+
+    def __init__(
+        self, username, concurrency=100, session=None, downloader=None, **kwargs
+    ):
+        if aiohttp is None:
+            raise ImportError(
+                "The async engine needs aiohttp, install it with "
+                "pip install vsco-scraper[async]"
+            )
+        super().__init__(username, 5, session, downloader, **kwargs)
+        self.concurrency = concurrency
+
+    def runPhases(self, *phases):
+        """
+        Runs phases one after another on a fresh event loop and http session
+        :params: phases - coroutine functions taking no arguments
+        :return: none
+        """
+
+        # Look the site id up before the loop starts, it's a single blocking request
+        self.resolveSite()
+
+        async def run():
+            connector = aiohttp.TCPConnector(limit=self.concurrency)
+            async with aiohttp.ClientSession(
+                connector=connector, cookies=self.session.cookies.get_dict()
+            ) as http:
+                self.http = http
+                self.limit = asyncio.Semaphore(self.concurrency)
+                for phase in phases:
+                    await phase()
+
+        asyncio.run(run())
+
+    def getImages(self):
+        """
+        Downloads the posts of the user on an event loop
+        :params: none
+        :return: none
+        """
+        self.runPhases(self.imagesAsync)
+
+    def getCollection(self):
+        """
+        Downloads the collection of the user on an event loop
+        :params: none
+        :return: none
+        """
+        self.runPhases(self.collectionAsync)
+
+    def getJournal(self):
+        """
+        Downloads the journal of the user on an event loop
+        :params: none
+        :return: none
+        """
+        self.runPhases(self.journalAsync)
+
+    def getProfile(self):
+        """
+        Downloads the profile picture of the user on an event loop
+        :params: none
+        :return: none
+        """
+        self.runPhases(self.profileAsync)
+
+    def run_all(self):
+        """
+        Downloads the posts, the collection and the journal of the user on one event loop
+        :params: none
+        :return: none
+        """
+        self.runPhases(self.imagesAsync, self.collectionAsync, self.journalAsync)
+
+    def run_all_profile(self):
+        """
+        Downloads everything run_all does and the profile picture on one event loop
+        :params: none
+        :return: none
+        """
+        self.runPhases(
+            self.imagesAsync, self.collectionAsync, self.journalAsync, self.profileAsync
+        )
+
+    async def fetchJson(self, url, params=None):
+        """
+        Gets an api response through the scheduler
+        :params: url - the api url, params - the query parameters
+        :return: the decoded json
+        """
+        began = time.monotonic()
+        data = await self.scheduler.acall(
+            lambda: self.requestJson(url, params), self.retried
+        )
+        self.record("api_requests")
+        self.observe("api", began)
+        return data
+
+    async def requestJson(self, url, params=None):
+        """
+        Gets an api response, through the metadata cache when there is one
+        :params: url - the api url, params - the query parameters
+        :return: the decoded json
+        """
+        headers = constants.media
+        if self.metadata is not None:
+            key = cacheKey(url, params)
+            entry = self.metadata.lookup(key)
+            headers = self.metadata.conditionalHeaders(entry, headers)
+        async with self.limit:
+            async with self.http.get(url, params=params, headers=headers) as res:
+                if self.metadata is not None and res.status == 304 and entry is not None:
+                    return self.metadata.hit(key, entry)
+                res.raise_for_status()
+                body = await res.read()
+                if self.metadata is not None:
+                    self.metadata.miss(key, url, res.headers, body)
+                return json.loads(body)
+
+    async def fetch(self, url, path, resumable=False):
+        """
+        Streams a url into path + ".part" and renames it into place, the same way
+        Scraper.fetchMedia does
+        :params: url - the media url, path - where the finished file should end up,
+        resumable - keep partial data on failure and continue it with a Range request
+        :return: the number of bytes written
+        """
+        loop = asyncio.get_running_loop()
+        if self.downloader.store is not None:
+            placed = await loop.run_in_executor(
+                None, self.downloader.place, url, path
+            )
+            if placed is not None:
+                self.record("linked")
+                await loop.run_in_executor(None, self.keep, path)
+                return 0
+        began = time.monotonic()
+        written = await self.holdSlot(url, path, resumable)
+        self.record("media_requests")
+        self.record("bytes", written)
+        self.observe("media", began)
+        await loop.run_in_executor(None, self.keep, path)
+        return written
+
+    async def holdSlot(self, url, path, resumable):
+        """
+        Downloads a url to a path once a --maxTransfers slot is free
+        :params: url - the media url, path - where the finished file should end up,
+        resumable - keep partial data on failure and continue it with a Range request
+        :return: the number of bytes written
+        """
+        slots = self.downloader.slots
+        if slots is None:
+            return await self.transfer(url, path, resumable)
+        # The cap is shared with threads, so poll it instead of blocking the loop.
+        # Nothing is held while sleeping, so a cancelled task can't leak a slot
+        while not slots.acquire(blocking=False):
+            await asyncio.sleep(0.05)
+        try:
+            return await self.transfer(url, path, resumable)
+        finally:
+            slots.release()
+
+    async def transfer(self, url, path, resumable):
+        """
+        Downloads a url to a path through the scheduler
+        :params: url - the media url, path - where the finished file should end up,
+        resumable - keep partial data on failure and continue it with a Range request
+        :return: the number of bytes written
+        """
+        return await self.scheduler.acall(
+            lambda: self.fetchFile(url, path, resumable), self.retried
+        )
+
+    async def fetchFile(self, url, path, resumable):
+        """
+        Downloads a url to a path once a transfer slot is held
+        :params: url - the media url, path - where the finished file should end up,
+        resumable - keep partial data on failure and continue it with a Range request
+        :return: the number of bytes written
+        """
+        part = path + ".part"
+        offset = 0
+        if resumable and os.path.exists(part):
+            offset = os.path.getsize(part)
+        digest = hashlib.sha256() if self.downloader.store is not None else None
+        try:
+            written = await self.stream(url, part, offset, digest)
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.downloader.finish, url, part, path, digest
+            )
+        except BaseException:
+            if not resumable and os.path.exists(part):
+                os.remove(part)
+            raise
+        return written
+
+    async def stream(self, url, part, offset, digest=None):
+        """
+        Writes the body of a url into the temporary file, starting at offset if the server allows it
+        :params: url - the media url, part - the temporary file, offset - bytes already on disk,
+        digest - a hashlib object fed the whole file, or None
+        :return: the number of bytes written by this call
+        """
+        headers = {"Range": "bytes=%d-" % offset} if offset > 0 else {}
+        loop = asyncio.get_running_loop()
+        async with self.limit:
+            async with self.http.get(url, headers=headers) as res:
+                if offset > 0 and res.status == 416:
+                    self.downloader.count("restarted")
+                    offset = -1
+                else:
+                    res.raise_for_status()
+                    mode = "wb"
+                    if offset > 0:
+                        if res.status == 206 and res.headers.get(
+                            "Content-Range", ""
+                        ).startswith("bytes %d-" % offset):
+                            mode = "ab"
+                            self.downloader.count("resumed")
+                            self.downloader.count("bytes_saved", offset)
+                        else:
+                            self.downloader.count("restarted")
+                    if mode == "ab" and digest is not None:
+                        await loop.run_in_executor(None, hashFile, part, digest)
+                    written = 0
+                    # The file is opened, written and hashed off the event loop, so a
+                    # slow disk doesn't hold up every other request
+                    f = await loop.run_in_executor(None, open, part, mode)
+
+                    def write(chunk):
+                        f.write(chunk)
+                        if digest is not None:
+                            digest.update(chunk)
+
+                    try:
+                        async for chunk in res.content.iter_chunked(
+                            self.downloader.chunk_size
+                        ):
+                            await loop.run_in_executor(None, write, chunk)
+                            written += len(chunk)
+                            if self.downloader.bandwidth is not None:
+                                await asyncio.sleep(
+                                    self.downloader.bandwidth.take(len(chunk))
+                                )
+                    finally:
+                        await loop.run_in_executor(None, f.close)
+                    expected = res.content_length
+                    if (
+                        expected is not None
+                        and "Content-Encoding" not in res.headers
+                        and written != expected
+                    ):
+                        raise DownloadError(
+                            "%s ended after %d of %d bytes" % (url, written, expected)
+                        )
+        if offset == -1:
+            # The partial file doesn't line up with the server copy anymore
+            return await self.stream(url, part, 0, digest)
+        return written
+
+    def enqueue(self, lists):
+        """
+        Keeps a media item for drain to put on the download queue
+        :params: lists - the media item
+        :return: none
+        """
+        self.noteQueued(lists[1], lists)
+        self.pending.append(lists)
+
+    def enqueueJournal(self, path, lists):
+        """
+        Keeps a journal item as [path, item] for drain to put on the download queue
+        :params: path - the article folder, lists - the item
+        :return: none
+        """
+        self.noteQueued(
+            "%s.txt" % str(lists[0]) if lists[1] == "txt" else lists[1], [path, lists]
+        )
+        self.pending.append([path, lists])
+
+    async def requeueAsync(self):
+        """
+        Hands the items an earlier try queued but never saved to the downloads
+        :params: none
+        :return: none
+        """
+        self.pending.extend(self.checkpoint.unfinished(self.username, self.phase))
+        await self.drain()
+
+    async def drain(self):
+        """
+        Moves the items found by the last listing call onto the download queue,
+        waiting while it's full
+        :params: none
+        :return: none
+        """
+        pending, self.pending = self.pending, []
+        for item in pending:
+            await self.queue.put(item, self.expectedSize(item))
+
+    async def pipeline(self, lister, download, desc):
+        """
+        Runs a listing coroutine and its downloads at the same time, through a
+        bounded queue like Scraper.pipeline
+        :params: lister - fills the queue through drain, download - takes one item,
+        desc - the progress bar text
+        :return: none
+        """
+        state = self.phaseState()
+        if state == DONE:
+            return
+        if state == LISTED:
+            lister = self.requeueAsync
+        listFailures = self.listFailures
+        failed = []
+        self.pending = []
+        self.queue = AsyncWorkQueue(maxsize=self.concurrency * 2)
+        bar = tqdm(desc=desc, unit=" posts")
+
+        async def consume(small_only):
+            while True:
+                lists = await self.queue.get(small_only)
+                if lists is None:
+                    return
+                try:
+                    await download(lists)
+                except Exception as exc:
+                    failed.append(lists)
+                    self.downloadFailed()
+                    print("%r crashed %s" % (lists, exc))
+                bar.update()
+
+        reserved = min(self.smallSlots, self.concurrency - 1)
+        consumers = [
+            asyncio.ensure_future(consume(slot < reserved))
+            for slot in range(self.concurrency)
+        ]
+        try:
+            await lister()
+            if self.listFailures == listFailures:
+                self.setPhase(LISTED)
+        finally:
+            await self.queue.close()
+            await asyncio.gather(*consumers)
+        self.queue = None
+        bar.close()
+        self.flushManifest()
+        if not failed and self.listFailures == listFailures:
+            self.setPhase(DONE)
+
+    async def listPages(self, url, key, kind, folder):
+        """
+        Lists every page of a media listing, picking pages the same way as
+        Scraper.listPages with at most self.listWorkers pages in flight
+        :params: url - the listing url, key - the json key holding the media,
+        kind - the latestCache section, folder - where the media is saved
+        :return: none
+        """
+        index = self.dirIndex(folder)
+        self.lastPage = None
+        self.pageCount = None
+        self.pageRequests = 0
+        workers = asyncio.Semaphore(self.listWorkers)
+
+        async def listPage(num):
+            if self.lastPage is not None and num > self.lastPage:
+                return False
+            try:
+                async with workers:
+                    data = await self.fetchJson(
+                        url, {"size": self.pageSize, "page": num}
+                    )
+                more = self.pageDone(data, key, kind, index, num)
+            except Exception as exc:
+                self.listFailed()
+                print("%r crashed %s" % (num, exc))
+                return False
+            await self.drain()
+            return more
+
+        if await listPage(1):
+            if self.pageCount is not None:
+                await asyncio.gather(
+                    *(listPage(num) for num in range(2, self.pageCount + 1))
+                )
+            else:
+                start, window = 2, 1
+                while all(
+                    await asyncio.gather(
+                        *(listPage(num) for num in range(start, start + window))
+                    )
+                ):
+                    start += window
+                    window = min(window * 2, self.listWorkers * 2)
+        self.pbar.set_postfix(pages=self.pageRequests)
+
+    def mediaDownload(self, folder, kind):
+        """
+        Makes the download coroutine for [url, id, is_video] items saved in a folder
+        :params: folder - where the media is saved, kind - the latestCache section
+        :return: a coroutine function taking one item
+        """
+        os.makedirs(folder, exist_ok=True)
+        index = self.dirIndex(folder)
+
+        async def download(lists):
+            name = "%s%s" % (lists[1], ".mp4" if lists[2] is True else ".jpg")
+            if index.has(name):
+                self.record("skipped_file")
+            else:
+                await self.fetch(
+                    lists[0], os.path.join(folder, name), resumable=lists[2] is True
+                )
+                index.add(name)
+            self.markDone(kind, lists[1], os.path.join(folder, name))
+
+        return download
+
+    async def listMedia(self, url, key, kind, folder, desc):
+        """
+        Lists every page of a media listing behind a progress bar
+        :params: url - the listing url, key - the json key holding the media,
+        kind - the latestCache section, folder - where the media is saved,
+        desc - the progress bar text
+        :return: none
+        """
+        self.pbar = tqdm(desc=desc, unit=" posts")
+        await self.listPages(url, key, kind, folder)
+        self.pbar.close()
+
+    @timedPhase("images")
+    async def imagesAsync(self):
+        """
+        Lists and downloads the posts of the user
+        :params: none
+        :return: none
+        """
+        self.imagelist = []
+        await self.pipeline(
+            lambda: self.listMedia(
+                self.mediaurl,
+                "media",
+                "images",
+                self.folder,
+                "Finding new posts from %s" % self.username,
+            ),
+            self.mediaDownload(self.folder, "images"),
+            "Downloading posts from %s" % self.username,
+        )
+
+    @timedPhase("collection")
+    async def collectionAsync(self):
+        """
+        Lists and downloads the collection of the user
+        :params: none
+        :return: none
+        """
+        self.imagelist = []
+        folder = os.path.join(self.folder, "collection")
+        await self.pipeline(
+            lambda: self.listMedia(
+                self.collectionurl,
+                "medias",
+                "collection",
+                folder,
+                "Finding new collection posts from %s" % self.username,
+            ),
+            self.mediaDownload(folder, "collection"),
+            "Downloading collection posts from %s" % self.username,
+        )
+
+    @timedPhase("profile")
+    async def profileAsync(self):
+        """
+        Looks up and downloads the current profile picture of the user
+        :params: none
+        :return: none
+        """
+        self.imagelist = []
+        folder = os.path.join(self.folder, "profile")
+
+        async def lister():
+            self.pbar = tqdm(
+                desc="Finding if a new profile picture exists from %s" % self.username,
+                unit=" post",
+            )
+            site = (await self.fetchJson(self.profileurl))["site"]
+            self.addProfile(site, self.dirIndex(folder))
+            self.pending.extend(self.imagelist)
+            await self.drain()
+            self.pbar.close()
+
+        await self.pipeline(
+            lister,
+            self.mediaDownload(folder, "profile"),
+            "Downloading a new profile picture from %s" % self.username,
+        )
+
+    @timedPhase("journal")
+    async def journalAsync(self):
+        """
+        Lists and downloads the journal articles of the user
+        :params: none
+        :return: none
+        """
+        folder = os.path.join(self.folder, "journal")
+
+        def lister():
+            os.makedirs(folder, exist_ok=True)
+            return self.listMedia(
+                self.journalurl,
+                "articles",
+                "journal",
+                folder,
+                "Finding new journal posts from %s" % self.username,
+            )
+
+        async def download(entry):
+            path, part = entry
+            os.makedirs(path, exist_ok=True)
+            index = self.dirIndex(path)
+            if part[1] == "txt":
+                name = "%s.txt" % str(part[0])
+                # Off the event loop like the media writes, the archive append blocks
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(
+                    None, self.downloader.writeText, part[0], os.path.join(path, name)
+                )
+                await loop.run_in_executor(None, self.keep, os.path.join(path, name))
+                key = name
+            else:
+                name = "%s%s" % (part[1], ".jpg" if part[2] == "img" else ".mp4")
+                key = part[1]
+                if index.has(name):
+                    self.record("skipped_file")
+                else:
+                    await self.fetch(
+                        part[0], os.path.join(path, name), resumable=part[2] == "vid"
+                    )
+            index.add(name)
+            self.markDone("journal", key, os.path.join(path, name))
+
+        await self.pipeline(
+            lister, download, "Downloading journal posts from %s" % self.username
+        )
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# This file holds the checkpoint journal that lets an interrupted run pick up where it stopped
+import json
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS phases (
+    run TEXT NOT NULL,
+    username TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (run, username, phase)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS items (
+    run TEXT NOT NULL,
+    username TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    key TEXT NOT NULL,
+    item TEXT,
+    state TEXT NOT NULL,
+    PRIMARY KEY (run, username, phase, key)
+) WITHOUT ROWID;
+"""
+
+# What a phase of a user has got through, in order
+LISTED = "listed"
+DONE = "done"
+
+
+class Checkpoint(object):
+    """
+    Records, for one run, which phases of which users were listed and finished, and
+    which of their media were queued and finished
+
+    A phase is "listed" once its listing went through without errors and "done" once
+    every item it queued was saved as well. Restarting the same run skips done phases
+    without an api request, and requeues what a listed phase had left instead of
+    listing it again. Item states are held in memory and committed every batch_size
+    items and at every phase change, so a crash loses at most one batch, which the
+    skip-if-exists checks catch anyway. run tells runs apart, e.g. by their options.
+    """
+
+    def __init__(self, path, run, batch_size=500):
+        self.path = path
+        self.run = run
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def phaseState(self, username, phase):
+        """
+        Looks up how far a phase of a user got
+        :params: username - the user, phase - "images", "collection", "journal" or "profile"
+        :return: LISTED, DONE, or None when it has to start from the beginning
+        """
+        with self.lock:
+            row = self.db.execute(
+                "SELECT state FROM phases WHERE run = ? AND username = ? AND phase = ?",
+                (self.run, username, phase),
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def setPhase(self, username, phase, state):
+        """
+        Records how far a phase of a user got, committing the items held in memory first
+        :params: username - the user, phase - the phase, state - LISTED or DONE
+        :return: none
+        """
+        with self.lock:
+            self.flushLocked()
+            self.db.execute(
+                "INSERT OR REPLACE INTO phases VALUES (?, ?, ?, ?)",
+                (self.run, username, phase, state),
+            )
+            self.db.commit()
+
+    def queued(self, username, phase, key, item):
+        """
+        Records an item handed to the downloads
+        :params: username - the user, phase - the phase, key - the id the item is
+        cached under, item - what was put on the download queue, json serializable
+        :return: none
+        """
+        with self.lock:
+            key = (username, phase, str(key))
+            if self.pending.get(key, (None, None))[1] == DONE:
+                return
+            self.pending[key] = (json.dumps(item), "queued")
+            if len(self.pending) >= self.batch_size:
+                self.flushLocked()
+
+    def done(self, username, phase, key):
+        """
+        Records an item that is saved
+        :params: username - the user, phase - the phase, key - the id the item is cached under
+        :return: none
+        """
+        with self.lock:
+            self.pending[(username, phase, str(key))] = (None, DONE)
+            if len(self.pending) >= self.batch_size:
+                self.flushLocked()
+
+    def unfinished(self, username, phase):
+        """
+        Gets the items of a phase that were queued but never saved
+        :params: username - the user, phase - the phase
+        :return: a list of the items as they were queued
+        """
+        with self.lock:
+            self.flushLocked()
+            rows = self.db.execute(
+                "SELECT item FROM items WHERE run = ? AND username = ? AND phase = ? "
+                "AND state = 'queued'",
+                (self.run, username, phase),
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def pendingUsers(self, usernames, phases):
+        """
+        Drops the users whose phases are all done
+        :params: usernames - the users, phases - the phases each of them runs
+        :return: a list of the users with work left, in the same order
+        """
+        with self.lock:
+            done = {}
+            for username, phase in self.db.execute(
+                "SELECT username, phase FROM phases WHERE run = ? AND state = ?",
+                (self.run, DONE),
+            ):
+                done.setdefault(username, set()).add(phase)
+        return [
+            username
+            for username in usernames
+            if not set(phases) <= done.get(username, set())
+        ]
+
+    def clear(self):
+        """
+        Forgets the run once it got to the end, so running it again starts over
+        :params: none
+        :return: none
+        """
+        with self.lock:
+            self.pending = {}
+            self.db.execute("DELETE FROM items WHERE run = ?", (self.run,))
+            self.db.execute("DELETE FROM phases WHERE run = ?", (self.run,))
+            self.db.commit()
+
+    def flushLocked(self):
+        """
+        Commits the item states held in memory, the caller holds self.lock
+        :params: none
+        :return: none
+        """
+        if not self.pending:
+            return
+        queued = []
+        done = []
+        for (username, phase, key), (item, state) in self.pending.items():
+            if state == DONE:
+                done.append((self.run, username, phase, key))
+            else:
+                queued.append((self.run, username, phase, key, item))
+        self.db.executemany(
+            "INSERT OR IGNORE INTO items VALUES (?, ?, ?, ?, ?, 'queued')", queued
+        )
+        self.db.executemany(
+            "INSERT INTO items VALUES (?, ?, ?, ?, NULL, 'done') "
+            "ON CONFLICT (run, username, phase, key) DO UPDATE SET state = 'done'",
+            done,
+        )
+        self.db.commit()
+        self.pending = {}
+
+    def close(self):
+        """
+        Commits what is left and closes the file
+        :params: none
+        :return: none
+        """
+        with self.lock:
+            self.flushLocked()
+            self.db.close()
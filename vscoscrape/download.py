@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# This file holds the code that streams media from the network onto the disk
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .mediastore import hashFile
+
+
+class DownloadError(Exception):
+    """
+    Raised when a download ended with a different number of bytes than the server announced
+    """
+
+
+class Bandwidth(object):
+    """
+    Caps the bytes per second read by every download sharing it, however many run at once
+
+    Downloads report each chunk they read and sleep for as long as the cap asks,
+    so the slow reads push back on the servers through TCP instead of dropping
+    downloads. Up to burst seconds of unused rate can be spent at once.
+    """
+
+    def __init__(self, rate, burst=1.0):
+        self.rate = float(rate)
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.until = time.monotonic()
+
+    def take(self, amount):
+        """
+        Accounts for bytes that were read
+        :params: amount - the number of bytes
+        :return: the seconds to wait before reading more
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.until = max(self.until, now - self.burst) + amount / self.rate
+            return max(self.until - now, 0)
+
+
+class Downloader(object):
+    """
+    Streams a url into a temporary file, checks the size, then renames it into place
+
+    A crash or a dropped connection never leaves a truncated file under the final name,
+    so skip-if-exists checks only ever see complete media. Resumable downloads keep
+    their temporary file when they fail, and pick it up with a Range request next time.
+    When segments is above 1, resumable media bigger than segment_threshold is split
+    into byte ranges that are fetched at the same time. max_transfers caps the files
+    being downloaded at once by every scraper sharing the Downloader, 0 for no cap.
+    With a Scheduler, every file waits for a request slot and a failed one is retried,
+    picking a resumable file up where the last try stopped. With a MediaStore, files
+    are hashed as they stream in and saved once in the store, linked to their paths.
+    With a Bandwidth, every chunk read counts against its cap.
+    """
+
+    def __init__(
+        self,
+        session,
+        chunk_size=1024 * 1024,
+        segments=1,
+        segment_threshold=64 * 1024 * 1024,
+        max_transfers=0,
+        scheduler=None,
+        store=None,
+        bandwidth=None,
+    ):
+        self.session = session
+        self.bandwidth = bandwidth
+        self.scheduler = scheduler
+        self.store = store
+        self.chunk_size = chunk_size
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.slots = None
+        if max_transfers:
+            self.slots = threading.BoundedSemaphore(max_transfers)
+        self.lock = threading.Lock()
+        self.stats = {"resumed": 0, "bytes_saved": 0, "restarted": 0, "segmented": 0}
+
+    def count(self, key, amount=1):
+        """
+        Adds to one of the download counters
+        :params: key - the counter, amount - how much to add
+        :return: none
+        """
+        with self.lock:
+            self.stats[key] += amount
+
+    def throttle(self, amount):
+        """
+        Waits as long as the bandwidth cap asks for after reading some bytes
+        :params: amount - the number of bytes read
+        :return: none
+        """
+        if self.bandwidth is not None:
+            time.sleep(self.bandwidth.take(amount))
+
+    def place(self, url, path):
+        """
+        Links media the MediaStore already holds to a path, so it isn't downloaded again
+        :params: url - the media url, path - where the file should end up
+        :return: the size of the file, or None when it has to be downloaded
+        """
+        if self.store is None:
+            return None
+        return self.store.place(url, path)
+
+    def finish(self, url, part, path, digest):
+        """
+        Renames a finished download into place, or hands it to the MediaStore
+        :params: url - the media url, part - the temporary file, path - where the
+        finished file should end up, digest - the sha256 of part, None without a store
+        :return: none
+        """
+        if digest is None:
+            os.replace(part, path)
+        else:
+            self.store.adopt(url, part, path, digest.hexdigest())
+
+    def fetch(self, url, path, resumable=False, retried=None):
+        """
+        Downloads a url to a path
+        :params: url - the media url, path - where the finished file should end up,
+        resumable - keep partial data on failure and continue it with a Range request,
+        retried - called before every retry the scheduler makes
+        :return: the number of bytes written
+        """
+        if self.slots is None:
+            return self.transfer(url, path, resumable, retried)
+        with self.slots:
+            return self.transfer(url, path, resumable, retried)
+
+    def transfer(self, url, path, resumable, retried=None):
+        """
+        Downloads a url to a path through the scheduler, when there is one
+        :params: url - the media url, path - where the finished file should end up,
+        resumable - keep partial data on failure and continue it with a Range request,
+        retried - called before every retry the scheduler makes
+        :return: the number of bytes written
+        """
+        if self.scheduler is None:
+            return self.fetchFile(url, path, resumable)
+        return self.scheduler.call(
+            lambda: self.fetchFile(url, path, resumable), retried
+        )
+
+    def fetchFile(self, url, path, resumable):
+        """
+        Downloads a url to a path once a transfer slot is held, in segments when it's
+        a large resumable file
+        :params: url - the media url, path - where the finished file should end up,
+        resumable - keep partial data on failure and continue it with a Range request
+        :return: the number of bytes written
+        """
+        part = path + ".part"
+        offset = 0
+        if resumable and os.path.exists(part):
+            offset = os.path.getsize(part)
+        if resumable and offset == 0 and self.segments > 1:
+            size = self.segmentable(url)
+            if size is not None:
+                return self.fetchSegmented(url, path, size)
+        digest = hashlib.sha256() if self.store is not None else None
+        try:
+            written = self.stream(url, part, offset, digest)
+            self.finish(url, part, path, digest)
+        except BaseException:
+            if not resumable and os.path.exists(part):
+                os.remove(part)
+            raise
+        return written
+
+    def stream(self, url, part, offset, digest=None):
+        """
+        Writes the body of a url into the temporary file, starting at offset if the server allows it
+        :params: url - the media url, part - the temporary file, offset - bytes already on disk,
+        digest - a hashlib object fed the whole file, or None
+        :return: the number of bytes written by this call
+        """
+        headers = {}
+        if offset > 0:
+            headers["Range"] = "bytes=%d-" % offset
+        with self.session.get(url, stream=True, headers=headers) as res:
+            if offset > 0 and res.status_code == 416:
+                # The partial file doesn't line up with the server copy anymore
+                res.close()
+                self.count("restarted")
+                return self.stream(url, part, 0, digest)
+            res.raise_for_status()
+            mode = "wb"
+            if offset > 0:
+                if res.status_code == 206 and res.headers.get(
+                    "Content-Range", ""
+                ).startswith("bytes %d-" % offset):
+                    mode = "ab"
+                    self.count("resumed")
+                    self.count("bytes_saved", offset)
+                else:
+                    self.count("restarted")
+            if mode == "ab" and digest is not None:
+                hashFile(part, digest)
+            written = 0
+            with open(part, mode) as f:
+                for chunk in res.iter_content(chunk_size=self.chunk_size):
+                    if chunk:
+                        f.write(chunk)
+                        if digest is not None:
+                            digest.update(chunk)
+                        written += len(chunk)
+                        self.throttle(len(chunk))
+            expected = res.headers.get("Content-Length")
+            if expected is not None and res.raw.tell() != int(expected):
+                raise DownloadError(
+                    "%s ended after %d of %s bytes" % (url, res.raw.tell(), expected)
+                )
+        return written
+
+    def segmentable(self, url):
+        """
+        Asks the server for the size of a url, to see if it's worth splitting up
+        :params: url - the media url
+        :return: the size in bytes, or None if it's too small or ranges aren't supported
+        """
+        res = self.session.head(url, allow_redirects=True)
+        if not res.ok or res.headers.get("Accept-Ranges") != "bytes":
+            return None
+        size = int(res.headers.get("Content-Length", 0))
+        if size < self.segment_threshold:
+            return None
+        return size
+
+    def fetchSegmented(self, url, path, size):
+        """
+        Downloads a url as several byte ranges at once, each written in place into
+        a temporary file of the final size
+        :params: url - the media url, path - where the finished file should end up,
+        size - the size of the media in bytes
+        :return: the number of bytes written
+        """
+        part = path + ".part"
+        step = -(-size // self.segments)
+        ranges = [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+        try:
+            with open(part, "wb") as f:
+                f.truncate(size)
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                written = sum(
+                    executor.map(
+                        lambda r: self.streamRange(url, part, r[0], r[1]), ranges
+                    )
+                )
+            if written != size:
+                raise DownloadError("%s ended after %d of %d bytes" % (url, written, size))
+            digest = None
+            if self.store is not None:
+                # Segments arrive out of order, so the file is hashed once it's whole
+                digest = hashFile(part, hashlib.sha256())
+            self.finish(url, part, path, digest)
+        except BaseException:
+            # Segments leave holes behind, so there is nothing to resume from
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+        self.count("segmented")
+        return written
+
+    def streamRange(self, url, part, start, end):
+        """
+        Writes one byte range of a url into its place in the temporary file
+        :params: url - the media url, part - the temporary file, start and end - the
+        first and last byte of the range
+        :return: the number of bytes written
+        """
+        headers = {"Range": "bytes=%d-%d" % (start, end)}
+        with self.session.get(url, stream=True, headers=headers) as res:
+            res.raise_for_status()
+            if res.status_code != 206:
+                raise DownloadError("%s ignored the range %d-%d" % (url, start, end))
+            written = 0
+            with open(part, "r+b") as f:
+                f.seek(start)
+                for chunk in res.iter_content(chunk_size=self.chunk_size):
+                    if chunk:
+                        f.write(chunk[: end + 1 - start - written])
+                        written += len(chunk)
+                        self.throttle(len(chunk))
+        if written != end + 1 - start:
+            raise DownloadError(
+                "%s range %d-%d ended after %d bytes" % (url, start, end, written)
+            )
+        return written
+
+    def writeText(self, text, path):
+        """
+        Writes a journal text block the same way media is written
+        :params: text - the text to write, path - where the finished file should end up
+        :return: the number of characters written
+        """
+        part = path + ".part"
+        try:
+            with open(part, "w") as f:
+                f.write(text)
+            os.replace(part, path)
+        except BaseException:
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+        return len(text)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# This file holds the directory index used to skip media that is already on disk
+import os
+import threading
+
+
+class DirIndex(object):
+    """
+    Keeps the file names of one directory in memory so existence checks don't
+    have to call os.listdir() for every media item
+
+    The directory is scanned once, then the scraper adds names as it writes files.
+    names skips the scan, e.g. for the names a Manifest says were saved.
+    """
+
+    def __init__(self, path, names=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.names = set()
+        if names is not None:
+            self.names = set(names)
+        elif os.path.isdir(path):
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    self.names.add(entry.name)
+
+    def has(self, name):
+        """
+        Checks if a file name is in the directory
+        :params: name - the file name, extension included
+        :return: a boolean on whether the file exists
+        """
+        with self.lock:
+            return name in self.names
+
+    def hasAny(self, stem, exts):
+        """
+        Checks if a media id was saved under any of the given extensions
+        :params: stem - the file name without extension, exts - the extensions to try
+        :return: a boolean on whether one of the files exists
+        """
+        with self.lock:
+            for ext in exts:
+                if "%s%s" % (stem, ext) in self.names:
+                    return True
+        return False
+
+    def add(self, name):
+        """
+        Records a file that was just written to the directory
+        :params: name - the file name, extension included
+        :return: none
+        """
+        with self.lock:
+            self.names.add(name)
+
+
+class IndexCache(object):
+    """
+    Hands out one DirIndex per directory, shared between the listing and download threads
+
+    With a Manifest, directories are filled from what it says was saved instead of
+    being scanned.
+    """
+
+    def __init__(self, manifest=None):
+        self.lock = threading.Lock()
+        self.indexes = {}
+        self.manifest = manifest
+
+    def get(self, path):
+        """
+        Returns the index for a directory, scanning it the first time it's asked for
+        :params: path - the directory
+        :return: the DirIndex of the directory
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            if path not in self.indexes:
+                names = None
+                if self.manifest is not None:
+                    names = self.manifest.namesIn(path)
+                self.indexes[path] = DirIndex(path, names)
+            return self.indexes[path]
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# This file holds the on-disk cache of api responses, revalidated with ETag/Last-Modified
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+
+def cacheKey(url, params=None):
+    """
+    Builds the key a response is cached under
+    :params: url - the api url, params - the query parameters
+    :return: a hex digest of the url and sorted parameters
+    """
+    full = url
+    if params:
+        full += "|" + urlencode(sorted((str(k), str(v)) for k, v in params.items()))
+    return hashlib.sha1(full.encode("utf-8")).hexdigest()
+
+
+class MetadataCache(object):
+    """
+    Keeps api responses that came with an ETag or Last-Modified in a sqlite file
+
+    The next request for the same url and parameters is sent with If-None-Match and
+    If-Modified-Since, and a 304 reuses the stored body. The least recently used
+    responses are dropped once the bodies add up to more than max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+        self.size = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def lookup(self, key):
+        """
+        Gets a cached response
+        :params: key - the cacheKey of the request
+        :return: (etag, last_modified, body), or None when nothing is cached
+        """
+        with self.lock:
+            return self.db.execute(
+                "SELECT etag, last_modified, body FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+    def conditionalHeaders(self, entry, headers):
+        """
+        Adds the validators of a cached response to the request headers
+        :params: entry - what lookup returned, headers - the request headers
+        :return: a new dict of headers
+        """
+        headers = dict(headers or {})
+        if entry is not None:
+            if entry[0]:
+                headers["If-None-Match"] = entry[0]
+            if entry[1]:
+                headers["If-Modified-Since"] = entry[1]
+        return headers
+
+    def hit(self, key, entry):
+        """
+        Records a 304 and hands back the cached json
+        :params: key - the cacheKey of the request, entry - what lookup returned
+        :return: the decoded json
+        """
+        with self.lock:
+            self.stats["hits"] += 1
+            self.db.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self.db.commit()
+        return json.loads(entry[2])
+
+    def miss(self, key, url, headers, body):
+        """
+        Records a full response, and stores it if it can be revalidated later
+        :params: key - the cacheKey of the request, url - the api url,
+        headers - the response headers, body - the raw response body
+        :return: none
+        """
+        etag = headers.get("ETag")
+        last_modified = headers.get("Last-Modified")
+        with self.lock:
+            self.stats["misses"] += 1
+            if not etag and not last_modified:
+                return
+            if len(body) > self.max_bytes:
+                return
+            old = self.db.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if old is not None:
+                self.size -= old[0]
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, url, etag, last_modified, body, len(body), time.time()),
+            )
+            self.size += len(body)
+            self.stats["stored"] += 1
+            self.evict()
+            self.db.commit()
+
+    def evict(self):
+        """
+        Drops the least recently used responses until the cache fits in max_bytes,
+        the caller holds self.lock
+        :params: none
+        :return: none
+        """
+        while self.size > self.max_bytes:
+            row = self.db.execute(
+                "SELECT key, size FROM responses ORDER BY last_used LIMIT 1"
+            ).fetchone()
+            if row is None:
+                self.size = 0
+                return
+            self.db.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            self.size -= row[1]
+            self.stats["evicted"] += 1
+
+    def get(
+        self, session, url, params=None, headers=None, scheduler=None, retried=None
+    ):
+        """
+        Gets the json of an api url through the cache
+        :params: session - the requests session, url - the api url,
+        params - the query parameters, headers - the request headers,
+        scheduler - the Scheduler the request goes through, or None,
+        retried - called before every retry the scheduler makes
+        :return: the decoded json
+        """
+        key = cacheKey(url, params)
+        entry = self.lookup(key)
+        headers = self.conditionalHeaders(entry, headers)
+
+        def send():
+            res = session.get(url, params=params, headers=headers)
+            if res.status_code >= 400:
+                res.raise_for_status()
+            return res
+
+        res = scheduler.call(send, retried) if scheduler is not None else send()
+        if res.status_code == 304 and entry is not None:
+            return self.hit(key, entry)
+        data = res.json()
+        if res.ok:
+            self.miss(key, url, res.headers, res.content)
+        return data
+
+    def close(self):
+        """
+        Closes the file
+        :params: none
+        :return: none
+        """
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# This file holds the per-user manifest of every media record listed and saved
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from datetime import timezone
+
+NAME = "manifest.jsonl"
+
+
+def readRecords(path):
+    """
+    Reads a manifest, skipping a line a crash cut short
+    :params: path - the manifest file
+    :return: a generator of the records as dicts
+    """
+    if not os.path.exists(path):
+        return
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+class Manifest(object):
+    """
+    Appends every media record of a user to folder/manifest.jsonl, one json object per line
+
+    "listed" records hold what the api said about an item (id, upload date, video or
+    not, url, dimensions) and "saved" records the file it ended up in and its size.
+    Each item is written once per event however many runs see it. Records are kept
+    in memory and appended batch_size at a time, and flush writes the rest.
+    """
+
+    def __init__(self, folder, batch_size=100):
+        self.folder = os.path.abspath(folder)
+        self.path = os.path.join(self.folder, NAME)
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = []
+        self.listed = set()
+        self.saved = {}
+        # Saved file names by the directory they are in, relative to folder
+        self.files = {}
+        for record in readRecords(self.path):
+            key = (record.get("kind"), record.get("key"))
+            if record.get("event") == "listed":
+                self.listed.add(key)
+            elif record.get("event") == "saved" and record.get("file"):
+                self.noteFile(key, record["file"])
+
+    def noteFile(self, key, file):
+        """
+        Remembers where an item was saved, the caller holds self.lock or is __init__
+        :params: key - (kind, key) of the item, file - its path relative to folder
+        :return: none
+        """
+        self.saved[key] = file
+        directory, name = os.path.split(file)
+        self.files.setdefault(directory or ".", set()).add(name)
+
+    def append(self, record):
+        """
+        Queues a record, writing the batch once it's full, the caller holds self.lock
+        :params: record - the dict to write
+        :return: none
+        """
+        record["at"] = int(time.time())
+        self.pending.append(json.dumps(record, sort_keys=True) + "\n")
+        if len(self.pending) >= self.batch_size:
+            self.flushLocked()
+
+    def addListed(self, kind, key, **fields):
+        """
+        Records what the api said about an item, unless that's already in the manifest
+        :params: kind - "images", "collection", "journal" or "profile", key - the id the
+        item is cached under, fields - what else is known about it
+        :return: none
+        """
+        with self.lock:
+            if (kind, key) in self.listed:
+                return
+            self.listed.add((kind, key))
+            record = {"event": "listed", "kind": kind, "key": key}
+            record.update(fields)
+            self.append(record)
+
+    def addSaved(self, kind, key, path, size=None):
+        """
+        Records the file an item was saved in, unless that's already in the manifest
+        :params: kind - the section of the item, key - its id, path - the file,
+        size - its size when it isn't on disk, e.g. in a TarArchive
+        :return: none
+        """
+        file = os.path.relpath(path, self.folder)
+        with self.lock:
+            if self.saved.get((kind, key)) == file:
+                return
+        if size is None:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return
+        with self.lock:
+            self.noteFile((kind, key), file)
+            self.append(
+                {"event": "saved", "kind": kind, "key": key, "file": file, "size": size}
+            )
+
+    def namesIn(self, path):
+        """
+        Gets the names of the files the manifest says were saved in a directory
+        :params: path - the directory
+        :return: a set of file names
+        """
+        folder = os.path.relpath(os.path.abspath(path), self.folder)
+        with self.lock:
+            return set(self.files.get(folder, ()))
+
+    def flush(self):
+        """
+        Writes the records still held in memory
+        :params: none
+        :return: none
+        """
+        with self.lock:
+            self.flushLocked()
+
+    def flushLocked(self):
+        """
+        Writes the records held in memory, the caller holds self.lock
+        :params: none
+        :return: none
+        """
+        if not self.pending:
+            return
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(self.pending)
+        self.pending = []
+
+
+def summarize(folder):
+    """
+    Adds up a user's manifest without touching the api or the media files
+    :params: folder - the user's folder, or the manifest itself
+    :return: a dict per kind with the items listed and saved, the videos, the bytes
+    saved and the first and last upload dates
+    """
+    path = folder if os.path.isfile(folder) else os.path.join(folder, NAME)
+    kinds = {}
+    for record in readRecords(path):
+        entry = kinds.setdefault(
+            record.get("kind"),
+            {
+                "listed": 0,
+                "saved": 0,
+                "videos": 0,
+                "bytes": 0,
+                "first": None,
+                "last": None,
+            },
+        )
+        if record.get("event") == "saved":
+            entry["saved"] += 1
+            entry["bytes"] += record.get("size") or 0
+            continue
+        entry["listed"] += 1
+        # Journal records of older manifests only carry their type
+        if record.get("is_video") or record.get("type") == "video":
+            entry["videos"] += 1
+        uploaded = record.get("upload_date")
+        if uploaded:
+            day = datetime.fromtimestamp(uploaded / 1000, timezone.utc)
+            day = day.strftime("%Y-%m-%d")
+            entry["first"] = min(entry["first"] or day, day)
+            entry["last"] = max(entry["last"] or day, day)
+    return kinds
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sums up the manifests written by vsco-scraper --manifest"
+    )
+    parser.add_argument("folders", nargs="+", help="user folders or manifest files")
+    args = parser.parse_args()
+    print(json.dumps({folder: summarize(folder) for folder in args.folders}, indent=4))
+
+
+if __name__ == "__main__":
+    main()
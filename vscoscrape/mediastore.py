@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# This file holds the content-addressed store that keeps one copy of every media file
+import os
+import re
+import shutil
+import sqlite3
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .variants import WIDTH_PARAM
+
+# The Linux ioctl that makes a copy-on-write clone of a file
+FICLONE = 0x40049409
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    key TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    size INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+LINKS = ("hard", "reflink", "symlink")
+
+
+def mediaKey(url):
+    """
+    Builds the key a media url is known under, the same file is served from several
+    hosts and under several schemes and query strings
+    :params: url - the media url
+    :return: the path of the url, with the width of a resized variant
+    """
+    address = re.sub(r"^([a-zA-Z]+:)?//", "", url).split("#")[0]
+    path, _, query = address.partition("?")
+    path = path[path.find("/") :] if "/" in path else path
+    # A resized variant holds other bytes than the original
+    for param in query.split("&"):
+        if param.startswith(WIDTH_PARAM + "="):
+            return "%s?%s" % (path, param)
+    return path
+
+
+def hashFile(path, digest, chunk_size=1024 * 1024):
+    """
+    Feeds the bytes already in a file to a hash
+    :params: path - the file, digest - a hashlib object, chunk_size - bytes read at a time
+    :return: the digest
+    """
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest
+
+
+class MediaStore(object):
+    """
+    Keeps every media file once under root/objects, named by the sha256 of its bytes,
+    with the usual user, collection and journal paths linked to that copy
+
+    The media url of every stored file is kept in root/index.db, so media that is
+    already stored is linked without being downloaded again. Files that were downloaded
+    under a new url but turn out to hold stored bytes are dropped for the stored copy.
+    link is "hard" (hardlinks, symlinks where the filesystem refuses them), "reflink"
+    (copy-on-write clones, plain copies where they aren't supported) or "symlink".
+    """
+
+    def __init__(self, root, link="hard"):
+        if link not in LINKS:
+            raise ValueError("link must be one of %s" % ", ".join(LINKS))
+        self.root = os.path.abspath(root)
+        self.objects = os.path.join(self.root, "objects")
+        os.makedirs(self.objects, exist_ok=True)
+        self.link = link
+        self.lock = threading.Lock()
+        self.stats = {"stored": 0, "linked": 0, "duplicates": 0, "bytes_saved": 0}
+        self.db = sqlite3.connect(
+            os.path.join(self.root, "index.db"), timeout=30, check_same_thread=False
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def objectPath(self, digest):
+        """
+        Finds where the copy of some content lives
+        :params: digest - the sha256 hex digest of the content
+        :return: the path under root/objects
+        """
+        return os.path.join(self.objects, digest[:2], digest[2:])
+
+    def place(self, url, path):
+        """
+        Links a stored media file to a path instead of downloading it
+        :params: url - the media url, path - where the file should end up
+        :return: the size of the file, or None when the url isn't stored
+        """
+        key = mediaKey(url)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT digest, size FROM media WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            stored = self.objectPath(row[0])
+            if not os.path.exists(stored):
+                # Someone cleaned the objects up by hand
+                self.db.execute("DELETE FROM media WHERE key = ?", (key,))
+                self.db.commit()
+                return None
+            self.stats["linked"] += 1
+            self.stats["bytes_saved"] += row[1]
+        self.linkTo(stored, path)
+        return row[1]
+
+    def adopt(self, url, part, path, digest):
+        """
+        Moves a finished download into the store and links it to its path
+        :params: url - the media url, part - the downloaded temporary file,
+        path - where the file should end up, digest - the sha256 hex digest of part
+        :return: none
+        """
+        stored = self.objectPath(digest)
+        size = os.path.getsize(part)
+        with self.lock:
+            if os.path.exists(stored):
+                os.remove(part)
+                self.stats["duplicates"] += 1
+                self.stats["bytes_saved"] += size
+            else:
+                os.makedirs(os.path.dirname(stored), exist_ok=True)
+                os.replace(part, stored)
+                self.stats["stored"] += 1
+            self.db.execute(
+                "INSERT OR REPLACE INTO media VALUES (?, ?, ?)",
+                (mediaKey(url), digest, size),
+            )
+            self.db.commit()
+        self.linkTo(stored, path)
+
+    def linkTo(self, stored, path):
+        """
+        Puts a link to a stored file at a path, replacing whatever is there
+        :params: stored - the file under root/objects, path - the link to make
+        :return: none
+        """
+        part = path + ".part"
+        if os.path.lexists(part):
+            os.remove(part)
+        try:
+            if self.link == "hard":
+                try:
+                    os.link(stored, part)
+                except OSError:
+                    # Another filesystem, or one without hardlinks
+                    os.symlink(stored, part)
+            elif self.link == "reflink":
+                self.clone(stored, part)
+            else:
+                os.symlink(stored, part)
+            os.replace(part, path)
+        except BaseException:
+            if os.path.lexists(part):
+                os.remove(part)
+            raise
+
+    def clone(self, stored, part):
+        """
+        Makes a copy-on-write clone of a stored file, or a plain copy where the
+        filesystem can't clone
+        :params: stored - the file under root/objects, part - the copy to make
+        :return: none
+        """
+        if fcntl is not None:
+            with open(stored, "rb") as src, open(part, "wb") as dst:
+                try:
+                    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                    return
+                except OSError:
+                    pass
+        shutil.copyfile(stored, part)
+
+    def close(self):
+        """
+        Closes the index
+        :params: none
+        :return: none
+        """
+        with self.lock:
+            self.db.close()
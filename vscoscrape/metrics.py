@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# This file holds the counters, latency histograms and phase timings of a run, and their exports
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+COUNTERS = (
+    "api_requests",
+    "media_requests",
+    "bytes",
+    "skipped_cache",
+    "skipped_file",
+    "linked",
+    "failures",
+    "retries",
+)
+
+
+def timedPhase(name):
+    """
+    Makes a Scraper method run as a phase, recording its wall time when the scraper has Metrics
+    :params: name - the phase, "images", "collection", "journal" or "profile"
+    :return: the decorator, for plain methods and coroutines alike
+    """
+
+    def wrap(method):
+        def record(self, began):
+            if self.metrics is not None:
+                self.metrics.phaseTime(self.username, name, time.monotonic() - began)
+
+        if asyncio.iscoroutinefunction(method):
+
+            @functools.wraps(method)
+            async def timedAsync(self, *args, **kwargs):
+                self.phase = name
+                began = time.monotonic()
+                try:
+                    return await method(self, *args, **kwargs)
+                finally:
+                    record(self, began)
+
+            return timedAsync
+
+        @functools.wraps(method)
+        def timed(self, *args, **kwargs):
+            self.phase = name
+            began = time.monotonic()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                record(self, began)
+
+        return timed
+
+    return wrap
+
+
+def label(value):
+    """
+    Escapes a Prometheus label value
+    :params: value - the value
+    :return: the escaped string
+    """
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metrics(object):
+    """
+    Counts requests, bytes, skips, failures and retries per user and phase, keeps a
+    latency histogram per request kind and the wall time of every phase
+
+    summary gives everything as a dict, prometheus as a textfile for the node exporter.
+    write saves both, and start writes them every interval seconds until stop.
+    """
+
+    def __init__(self, json_path=None, prometheus_path=None):
+        self.json_path = json_path
+        self.prometheus_path = prometheus_path
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.phases = {}
+        self.latency = {}
+        self.started = time.time()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def count(self, user, phase, key, amount=1):
+        """
+        Adds to a counter
+        :params: user - the username, phase - "images", "collection", "journal",
+        "profile" or "sites", key - one of COUNTERS, amount - how much to add
+        :return: none
+        """
+        with self.lock:
+            counters = self.counters.get((user, phase))
+            if counters is None:
+                counters = self.counters[(user, phase)] = dict.fromkeys(COUNTERS, 0)
+            counters[key] += amount
+
+    def observe(self, kind, seconds):
+        """
+        Records how long a request took
+        :params: kind - "api" or "media", seconds - the duration
+        :return: none
+        """
+        with self.lock:
+            histogram = self.latency.get(kind)
+            if histogram is None:
+                histogram = {"buckets": [0] * len(BUCKETS), "count": 0, "sum": 0.0}
+                self.latency[kind] = histogram
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+                    break
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+
+    def phaseTime(self, user, phase, seconds):
+        """
+        Records the wall time of a phase
+        :params: user - the username, phase - the phase, seconds - how long it ran
+        :return: none
+        """
+        with self.lock:
+            self.phases[(user, phase)] = self.phases.get((user, phase), 0) + seconds
+
+    def summary(self):
+        """
+        Gets everything recorded so far
+        :params: none
+        :return: a dict with the totals, the counters and phase times per user and
+        phase, and the latency histograms with cumulative buckets
+        """
+        with self.lock:
+            users = {}
+            totals = dict.fromkeys(COUNTERS, 0)
+            for (user, phase), counters in self.counters.items():
+                users.setdefault(user, {})[phase] = dict(counters)
+                for key, value in counters.items():
+                    totals[key] += value
+            for (user, phase), seconds in self.phases.items():
+                entry = users.setdefault(user, {}).setdefault(
+                    phase, dict.fromkeys(COUNTERS, 0)
+                )
+                entry["seconds"] = round(seconds, 3)
+            latency = {}
+            for kind, histogram in self.latency.items():
+                running = 0
+                buckets = {}
+                for bound, hits in zip(BUCKETS, histogram["buckets"]):
+                    running += hits
+                    buckets[str(bound)] = running
+                buckets["+Inf"] = histogram["count"]
+                latency[kind] = {
+                    "count": histogram["count"],
+                    "sum": round(histogram["sum"], 6),
+                    "buckets": buckets,
+                }
+        return {
+            "started": int(self.started),
+            "elapsed": round(time.time() - self.started, 3),
+            "totals": totals,
+            "users": users,
+            "latency": latency,
+        }
+
+    def prometheus(self):
+        """
+        Formats everything recorded so far for the node exporter textfile collector
+        :params: none
+        :return: the text
+        """
+        summary = self.summary()
+        lines = []
+        for key in COUNTERS:
+            name = "vsco_%s_total" % key
+            lines.append("# TYPE %s counter" % name)
+            for user, phases in sorted(summary["users"].items()):
+                for phase, counters in sorted(phases.items()):
+                    lines.append(
+                        '%s{user="%s",phase="%s"} %d'
+                        % (name, label(user), label(phase), counters[key])
+                    )
+        lines.append("# TYPE vsco_phase_seconds gauge")
+        for user, phases in sorted(summary["users"].items()):
+            for phase, counters in sorted(phases.items()):
+                if "seconds" in counters:
+                    lines.append(
+                        'vsco_phase_seconds{user="%s",phase="%s"} %s'
+                        % (label(user), label(phase), counters["seconds"])
+                    )
+        lines.append("# TYPE vsco_request_seconds histogram")
+        for kind, histogram in sorted(summary["latency"].items()):
+            for bound, hits in histogram["buckets"].items():
+                lines.append(
+                    'vsco_request_seconds_bucket{kind="%s",le="%s"} %d'
+                    % (label(kind), bound, hits)
+                )
+            lines.append(
+                'vsco_request_seconds_sum{kind="%s"} %s' % (label(kind), histogram["sum"])
+            )
+            lines.append(
+                'vsco_request_seconds_count{kind="%s"} %d'
+                % (label(kind), histogram["count"])
+            )
+        lines.append("# TYPE vsco_run_seconds gauge")
+        lines.append("vsco_run_seconds %s" % summary["elapsed"])
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        """
+        Saves the json summary and the Prometheus textfile, each renamed into place
+        so readers never see half a file
+        :params: none
+        :return: none
+        """
+        for path, text in (
+            (self.json_path, lambda: json.dumps(self.summary(), indent=4)),
+            (self.prometheus_path, self.prometheus),
+        ):
+            if path is None:
+                continue
+            part = path + ".part"
+            with open(part, "w") as f:
+                f.write(text())
+            os.replace(part, path)
+
+    def start(self, interval):
+        """
+        Writes the exports every interval seconds on a background thread
+        :params: interval - seconds between writes, 0 to only write in stop
+        :return: none
+        """
+        if interval <= 0 or self.thread is not None:
+            return
+
+        def run():
+            while not self.stopped.wait(interval):
+                try:
+                    self.write()
+                except OSError as exc:
+                    print("Writing metrics crashed %s" % exc)
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the background writes and writes the final exports
+        :params: none
+        :return: none
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.write()
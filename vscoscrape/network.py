@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# This file holds the pooled http client shared by every request the scraper makes
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class CountingAdapter(HTTPAdapter):
+    """
+    An HTTPAdapter whose pool size follows the worker count, and that can report
+    how many requests were served by how many connections
+    """
+
+    def __init__(self, pool_size=5, hosts=10):
+        super().__init__(pool_connections=hosts, pool_maxsize=pool_size)
+
+    def stats(self):
+        """
+        Adds up the request and connection counters of every host pool
+        :params: none
+        :return: a dict with the requests, connections and reused counts
+        """
+        requests_made = 0
+        connections = 0
+        pools = self.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            requests_made += pool.num_requests
+            connections += pool.num_connections
+        return {
+            "requests": requests_made,
+            "connections": connections,
+            "reused": max(requests_made - connections, 0),
+        }
+
+
+def makeSession(pool_size=5):
+    """
+    Creates the session used for api calls and media downloads
+    :params: pool_size - how many connections to keep open per host
+    :return: a requests.Session with a CountingAdapter mounted
+    """
+    session = requests.Session()
+    adapter = CountingAdapter(pool_size=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def connectionStats(session):
+    """
+    Gets the connection reuse counters of a session made by makeSession
+    :params: session - the session
+    :return: a dict with the requests, connections and reused counts
+    """
+    total = {"requests": 0, "connections": 0, "reused": 0}
+    for adapter in set(session.adapters.values()):
+        if isinstance(adapter, CountingAdapter):
+            for key, value in adapter.stats().items():
+                total[key] += value
+    return total
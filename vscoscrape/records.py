@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# This file holds the media record the iterator api yields
+from collections import namedtuple
+
+
+class MediaRecord(
+    namedtuple(
+        "MediaRecord",
+        (
+            "kind",
+            "key",
+            "url",
+            "name",
+            "is_video",
+            "upload_date",
+            "id",
+            "width",
+            "height",
+            "text",
+        ),
+    )
+):
+    """
+    One file a listing found, as Scraper.iter_media yields it and Scraper.save_media
+    takes it
+
+    kind is "images", "collection", "journal" or "profile", key the id the file is
+    cached under for --latest and name its path relative to the user's folder, with
+    / separators. url is None for journal text, whose words are in text. upload_date
+    is in milliseconds. Fields the api didn't give are None.
+    """
+
+    __slots__ = ()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# This file holds the scheduler every api call and download goes through, with retries and adaptive concurrency
+import asyncio
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+from .download import DownloadError
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Statuses worth asking again for, and the ones that mean the server wants us to slow down
+RETRY_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+THROTTLE_STATUSES = (429, 503)
+
+
+def checked(res):
+    """
+    Raises the error status of a response so the scheduler can retry it
+    :params: res - a requests response
+    :return: the response
+    """
+    res.raise_for_status()
+    return res
+
+
+def retryAfter(headers):
+    """
+    Reads a Retry-After header
+    :params: headers - the response headers, or None
+    :return: the seconds to wait, or None when there is no usable header
+    """
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(when.timestamp() - time.time(), 0)
+
+
+def classify(exc):
+    """
+    Decides what a failed request means for the scheduler
+    :params: exc - the exception the request raised
+    :return: (retry, throttle, wait) - whether to try again, whether to lower the
+    concurrency, and the Retry-After delay in seconds or None
+    """
+    status = None
+    headers = None
+    if isinstance(exc, requests.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        headers = exc.response.headers
+    elif aiohttp is not None and isinstance(exc, aiohttp.ClientResponseError):
+        status = exc.status
+        headers = exc.headers
+    if status is not None:
+        return status in RETRY_STATUSES, status in THROTTLE_STATUSES, retryAfter(headers)
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True, True, None
+    if aiohttp is not None and isinstance(exc, aiohttp.ClientConnectionError):
+        return True, True, None
+    if isinstance(exc, asyncio.TimeoutError):
+        return True, True, None
+    if isinstance(exc, (requests.RequestException, DownloadError)):
+        return True, False, None
+    if aiohttp is not None and isinstance(exc, aiohttp.ClientPayloadError):
+        return True, False, None
+    return False, False, None
+
+
+class Scheduler(object):
+    """
+    Limits how many requests are in flight and how fast they start, and retries the ones that fail
+
+    The limit grows by about one for every limit requests that succeed and halves when
+    the server throttles (429/503) or drops connections, at most once per second
+    (AIMD). rate caps the requests started per second with a token bucket, 0 for no
+    cap. Failed requests are retried up to retries times after a jittered exponential
+    backoff, or after Retry-After when the server sends one, which also pauses every
+    other request. Threads wait in call, coroutines in acall, and both share the limit.
+    """
+
+    def __init__(
+        self,
+        max_limit=10,
+        limit=None,
+        min_limit=1,
+        rate=0,
+        retries=3,
+        backoff=0.5,
+        max_backoff=30,
+    ):
+        self.max_limit = max(max_limit, 1)
+        self.min_limit = max(min(min_limit, self.max_limit), 1)
+        if limit is None:
+            limit = self.max_limit // 2
+        self.limit = float(min(max(limit, self.min_limit), self.max_limit))
+        self.rate = rate
+        self.tokens = float(max(rate, 1))
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.inflight = 0
+        self.pausedUntil = 0.0
+        self.lastDecrease = 0.0
+        self.started = time.monotonic()
+        self.lastChange = self.started
+        self.refilled = self.started
+        self.busy = 0.0
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "throttled": 0,
+            "peak": 0,
+        }
+
+    def tick(self, now):
+        # Adds up the time spent at each in-flight count, for the average concurrency
+        self.busy += self.inflight * (now - self.lastChange)
+        self.lastChange = now
+
+    def reserve(self):
+        """
+        Takes a slot and a token if both are free, the caller holds self.lock
+        :params: none
+        :return: 0 once taken, the seconds to wait before trying again, or None to
+        wait for a request to finish
+        """
+        now = time.monotonic()
+        if now < self.pausedUntil:
+            return self.pausedUntil - now
+        if self.inflight >= int(self.limit):
+            return None
+        if self.rate:
+            self.tokens = min(
+                self.tokens + (now - self.refilled) * self.rate, max(self.rate, 1)
+            )
+            self.refilled = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+        self.tick(now)
+        self.inflight += 1
+        self.stats["requests"] += 1
+        self.stats["peak"] = max(self.stats["peak"], self.inflight)
+        return 0
+
+    def acquire(self):
+        """
+        Waits for a slot and a token
+        :params: none
+        :return: none
+        """
+        with self.ready:
+            while True:
+                wait = self.reserve()
+                if wait == 0:
+                    return
+                self.ready.wait(wait)
+
+    async def acquireAsync(self):
+        """
+        Waits for a slot and a token without blocking the event loop
+        :params: none
+        :return: none
+        """
+        while True:
+            with self.lock:
+                wait = self.reserve()
+            if wait == 0:
+                return
+            await asyncio.sleep(wait if wait is not None else 0.02)
+
+    def release(self, throttled=False, wait=None):
+        """
+        Gives a slot back and adjusts the limit to how the request went
+        :params: throttled - the server asked us to slow down, wait - its Retry-After
+        :return: none
+        """
+        with self.ready:
+            now = time.monotonic()
+            self.tick(now)
+            self.inflight -= 1
+            if throttled:
+                self.stats["throttled"] += 1
+                if now - self.lastDecrease >= 1:
+                    self.limit = max(self.limit / 2, self.min_limit)
+                    self.lastDecrease = now
+            else:
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+            if wait:
+                self.pausedUntil = max(self.pausedUntil, now + wait)
+            self.ready.notify_all()
+
+    def delay(self, attempt, exc):
+        """
+        Decides if a failed request gets another try
+        :params: attempt - the tries so far, counting from 0, exc - what it raised
+        :return: the seconds to wait before the next try, or None to give up
+        """
+        retry, throttled, wait = classify(exc)
+        self.release(throttled, wait)
+        if not retry or attempt >= self.retries:
+            with self.lock:
+                self.stats["failures"] += 1
+            return None
+        with self.lock:
+            self.stats["retries"] += 1
+        jitter = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        return max(jitter, wait or 0)
+
+    def call(self, fn, retried=None):
+        """
+        Runs a request once a slot is free, retrying it when it fails
+        :params: fn - makes the request, raising on failure, retried - called with no
+        arguments before every retry, or None
+        :return: what fn returned
+        """
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                result = fn()
+            except Exception as exc:
+                wait = self.delay(attempt, exc)
+                if wait is None:
+                    raise
+                if retried is not None:
+                    retried()
+                time.sleep(wait)
+                attempt += 1
+                continue
+            except BaseException:
+                self.release()
+                raise
+            self.release()
+            return result
+
+    async def acall(self, fn, retried=None):
+        """
+        Runs a request coroutine once a slot is free, retrying it when it fails
+        :params: fn - makes the coroutine of the request, raising on failure,
+        retried - called with no arguments before every retry, or None
+        :return: what the coroutine returned
+        """
+        attempt = 0
+        while True:
+            await self.acquireAsync()
+            try:
+                result = await fn()
+            except Exception as exc:
+                wait = self.delay(attempt, exc)
+                if wait is None:
+                    raise
+                if retried is not None:
+                    retried()
+                await asyncio.sleep(wait)
+                attempt += 1
+                continue
+            except BaseException:
+                self.release()
+                raise
+            self.release()
+            return result
+
+    def summary(self):
+        """
+        Gets the counters of the run so far
+        :params: none
+        :return: a dict with the request, retry, failure and throttle counts, the
+        average and peak concurrency and the current limit
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tick(now)
+            summary = dict(self.stats)
+            summary["average"] = self.busy / max(now - self.started, 1e-9)
+            summary["limit"] = int(self.limit)
+        return summary
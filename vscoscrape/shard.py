@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# This file holds the lease table that shares a username list between processes and hosts
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    run TEXT NOT NULL,
+    phase TEXT NOT NULL,
+    username TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    finished REAL,
+    PRIMARY KEY (run, phase, username)
+) WITHOUT ROWID;
+"""
+
+
+def workerName():
+    """
+    Names this process for the lease table
+    :params: none
+    :return: "host:pid"
+    """
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+class LeaseTable(object):
+    """
+    Hands the users of a run out to workers one at a time through a sqlite file on
+    storage every worker can reach
+
+    A worker leases a user for lease seconds and renews its leases while it scrapes.
+    A lease that runs out, because its worker died, goes to the next worker that asks.
+    A user that crashes is handed out again until it has been tried max_attempts times.
+    run tells runs apart, e.g. by their options, and phase the passes of a run.
+    """
+
+    def __init__(self, path, run, lease=300, max_attempts=3):
+        self.path = path
+        self.run = run
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        # isolation_level=None lets claim take the write lock with BEGIN IMMEDIATE
+        self.db = sqlite3.connect(
+            path, timeout=60, check_same_thread=False, isolation_level=None
+        )
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def load(self, phase, usernames):
+        """
+        Adds the users of a phase that aren't in the table yet, as pending
+        :params: phase - the Scraper method run for them, usernames - the users
+        :return: none
+        """
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO leases (run, phase, username, position, state) "
+                    "VALUES (?, ?, ?, ?, 'pending')",
+                    [
+                        (self.run, phase, username, position)
+                        for position, username in enumerate(usernames)
+                    ],
+                )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def claim(self, phase, worker):
+        """
+        Leases the next user that is pending or whose lease ran out, failing users
+        whose lease ran out on their last attempt
+        :params: phase - the Scraper method, worker - the name of the worker
+        :return: the username, or None when there is nothing left to hand out
+        """
+        now = time.time()
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                # A user whose workers keep dying has run out of tries like one that crashes
+                self.db.execute(
+                    "UPDATE leases SET state = 'failed', expires = NULL, finished = ? "
+                    "WHERE run = ? AND phase = ? AND state = 'leased' AND expires < ? "
+                    "AND attempts >= ?",
+                    (now, self.run, phase, now, self.max_attempts),
+                )
+                row = self.db.execute(
+                    "SELECT username FROM leases WHERE run = ? AND phase = ? AND "
+                    "(state = 'pending' OR (state = 'leased' AND expires < ?)) "
+                    "ORDER BY position LIMIT 1",
+                    (self.run, phase, now),
+                ).fetchone()
+                if row is not None:
+                    self.db.execute(
+                        "UPDATE leases SET state = 'leased', worker = ?, expires = ?, "
+                        "attempts = attempts + 1 WHERE run = ? AND phase = ? AND username = ?",
+                        (worker, now + self.lease, self.run, phase, row[0]),
+                    )
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return row[0] if row is not None else None
+
+    def renew(self, worker):
+        """
+        Extends every lease a worker holds
+        :params: worker - the name of the worker
+        :return: none
+        """
+        with self.lock:
+            self.db.execute(
+                "UPDATE leases SET expires = ? WHERE run = ? AND worker = ? "
+                "AND state = 'leased'",
+                (time.time() + self.lease, self.run, worker),
+            )
+
+    def finish(self, phase, username, worker, ok=True):
+        """
+        Gives a lease back once its user is scraped, or crashed
+        :params: phase - the Scraper method, username - the user, worker - the name of
+        the worker, ok - False when the scrape crashed, it's handed out again unless it
+        ran out of attempts
+        :return: none
+        """
+        with self.lock:
+            if ok:
+                state = "done"
+            else:
+                row = self.db.execute(
+                    "SELECT attempts FROM leases WHERE run = ? AND phase = ? AND username = ?",
+                    (self.run, phase, username),
+                ).fetchone()
+                state = "failed" if row and row[0] >= self.max_attempts else "pending"
+            # A worker whose lease ran out and was taken over doesn't get a say anymore
+            self.db.execute(
+                "UPDATE leases SET state = ?, expires = NULL, finished = ? "
+                "WHERE run = ? AND phase = ? AND username = ? AND worker = ? "
+                "AND state = 'leased'",
+                (state, time.time(), self.run, phase, username, worker),
+            )
+
+    def reset(self):
+        """
+        Puts every user of the run back to pending, to run it all over again
+        :params: none
+        :return: none
+        """
+        with self.lock:
+            self.db.execute(
+                "UPDATE leases SET state = 'pending', worker = NULL, expires = NULL, "
+                "attempts = 0, finished = NULL WHERE run = ?",
+                (self.run,),
+            )
+
+    def summary(self):
+        """
+        Gets the progress of the run across every worker
+        :params: none
+        :return: a dict with the users per state of every phase, the users each worker
+        finished and holds, and the leases that ran out
+        """
+        now = time.time()
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT phase, state, worker, expires FROM leases WHERE run = ?",
+                (self.run,),
+            ).fetchall()
+        phases = {}
+        workers = {}
+        expired = 0
+        for phase, state, worker, expires in rows:
+            counts = phases.setdefault(
+                phase, {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+            )
+            counts[state] += 1
+            if worker is None:
+                continue
+            held = workers.setdefault(worker, {"done": 0, "failed": 0, "leased": 0})
+            if state in held:
+                held[state] += 1
+            if state == "leased" and expires is not None and expires < now:
+                expired += 1
+        return {"phases": phases, "workers": workers, "expired": expired}
+
+    def heartbeat(self, worker):
+        """
+        Renews the leases of a worker every third of a lease on a background thread
+        :params: worker - the name of the worker
+        :return: a threading.Event that stops the renewals once set
+        """
+        stopped = threading.Event()
+
+        def run():
+            while not stopped.wait(self.lease / 3):
+                try:
+                    self.renew(worker)
+                except sqlite3.Error as exc:
+                    print("Renewing the leases of %s crashed %s" % (worker, exc))
+
+        threading.Thread(target=run, daemon=True).start()
+        return stopped
+
+    def close(self):
+        """
+        Closes the file
+        :params: none
+        :return: none
+        """
+        with self.lock:
+            self.db.close()
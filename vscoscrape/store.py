@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# This file holds the sqlite store that remembers site ids and already seen media
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sites (
+    username TEXT PRIMARY KEY,
+    site_id TEXT NOT NULL,
+    site_collection_id TEXT,
+    resolved_at REAL
+);
+CREATE TABLE IF NOT EXISTS seen (
+    username TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    media_id TEXT NOT NULL,
+    seen_date TEXT,
+    PRIMARY KEY (username, kind, media_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class StateStore(object):
+    """
+    Keeps the --cacheHit site ids and the --latest seen media in one sqlite file
+
+    Media only counts as seen once it's saved, so an interrupted run never hides
+    anything it didn't download. New seen media is held in memory and committed every batch_size items, so a crash
+    only loses the last batch. The file is in WAL mode, so several runs can share it.
+    """
+
+    def __init__(self, path, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(sites)")]
+        if "resolved_at" not in columns:
+            # Stores made before site lookups expired
+            self.db.execute("ALTER TABLE sites ADD COLUMN resolved_at REAL")
+        self.db.commit()
+
+    def getSite(self, username, ttl=None):
+        """
+        Looks up the cached site id of a user
+        :params: username - the user, ttl - only return ids looked up less than this
+        many seconds ago, None to return them however old they are
+        :return: [site id, site collection id], or None if the user isn't cached
+        """
+        query = "SELECT site_id, site_collection_id FROM sites WHERE username = ?"
+        params = (username,)
+        if ttl is not None:
+            query += " AND resolved_at >= ?"
+            params += (time.time() - ttl,)
+        with self.lock:
+            row = self.db.execute(query, params).fetchone()
+        return list(row) if row is not None else None
+
+    def setSite(self, username, siteid, sitecollectionid):
+        """
+        Caches the site id of a user
+        :params: username - the user, siteid and sitecollectionid - the ids to cache
+        :return: none
+        """
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO sites VALUES (?, ?, ?, ?)",
+                (username, str(siteid), sitecollectionid, time.time()),
+            )
+            self.db.commit()
+
+    def isSeen(self, username, kind, media_id):
+        """
+        Tells if a media item was recorded as seen, without recording it
+        :params: username - the user, kind - "images", "collection", "journal" or
+        "profile", media_id - the id the item is cached under
+        :return: a boolean
+        """
+        key = (username, kind, str(media_id))
+        with self.lock:
+            if key in self.pending:
+                return True
+            row = self.db.execute(
+                "SELECT 1 FROM seen WHERE username = ? AND kind = ? AND media_id = ?",
+                key,
+            ).fetchone()
+        return row is not None
+
+    def markSeen(self, username, kind, media_id):
+        """
+        Records a media item as seen, which is done once it is on disk
+        :params: username - the user, kind - "images", "collection", "journal" or
+        "profile", media_id - the id the item is cached under
+        :return: True if the item is new, False if it was seen before
+        """
+        key = (username, kind, str(media_id))
+        with self.lock:
+            if key in self.pending:
+                return False
+            row = self.db.execute(
+                "SELECT 1 FROM seen WHERE username = ? AND kind = ? AND media_id = ?",
+                key,
+            ).fetchone()
+            if row is not None:
+                return False
+            self.pending[key] = date.today().strftime("%m-%d-%Y")
+            if len(self.pending) >= self.batch_size:
+                self.flushLocked()
+        return True
+
+    def flush(self):
+        """
+        Commits the seen media still held in memory
+        :params: none
+        :return: none
+        """
+        with self.lock:
+            self.flushLocked()
+
+    def flushLocked(self):
+        """
+        Commits the seen media held in memory, the caller holds self.lock
+        :params: none
+        :return: none
+        """
+        if not self.pending:
+            return
+        self.db.executemany(
+            "INSERT OR IGNORE INTO seen VALUES (?, ?, ?, ?)",
+            [key + (seen_date,) for key, seen_date in self.pending.items()],
+        )
+        self.db.commit()
+        self.pending = {}
+
+    def close(self):
+        """
+        Commits what is left and closes the file
+        :params: none
+        :return: none
+        """
+        self.flush()
+        self.db.close()
+
+    def importJson(self, cache_file=None, latest_file=None):
+        """
+        Copies the old json cache files into the store, once per file
+        :params: cache_file - a --cacheHit _cache_store file, latest_file - a --latest
+        _latest_cache_store file
+        :return: the number of rows imported
+        """
+        imported = 0
+        for file, load in ((cache_file, self.loadSites), (latest_file, self.loadSeen)):
+            if file is None or not os.path.exists(file):
+                continue
+            key = "imported:%s" % os.path.abspath(file)
+            with self.lock:
+                if self.db.execute(
+                    "SELECT 1 FROM meta WHERE key = ?", (key,)
+                ).fetchone():
+                    continue
+            try:
+                with open(file, encoding="utf-8") as f:
+                    data = json.load(f)
+            except ValueError:
+                data = {}
+            with self.lock:
+                imported += load(data)
+                self.db.execute("INSERT INTO meta VALUES (?, ?)", (key, "1"))
+                self.db.commit()
+        return imported
+
+    def loadSites(self, data):
+        """
+        Inserts the contents of a _cache_store file, the caller holds self.lock
+        :params: data - the decoded json, username to [site id, site collection id]
+        :return: the number of rows read
+        """
+        rows = [(user, str(ids[0]), ids[1]) for user, ids in data.items()]
+        self.db.executemany(
+            "INSERT OR IGNORE INTO sites (username, site_id, site_collection_id) "
+            "VALUES (?, ?, ?)",
+            rows,
+        )
+        return len(rows)
+
+    def loadSeen(self, data):
+        """
+        Inserts the contents of a _latest_cache_store file, the caller holds self.lock
+        :params: data - the decoded json, username to kind to media id to date
+        :return: the number of rows read
+        """
+        rows = [
+            (user, kind, str(media_id), seen_date)
+            for user, kinds in data.items()
+            for kind, media in kinds.items()
+            for media_id, seen_date in media.items()
+        ]
+        self.db.executemany("INSERT OR IGNORE INTO seen VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# This file holds the resized image variants a run can ask the image servers for
+# The query parameter the image servers resize by, to this many pixels wide
+WIDTH_PARAM = "w"
+# The width that stands for the original, as uploaded
+ORIGINAL = 0
+
+
+def variantUrl(url, width):
+    """
+    Builds the url of an image resized to a width
+    :params: url - the image url, width - the width in pixels, ORIGINAL for the original
+    :return: the url of the variant
+    """
+    base, _, query = url.partition("?")
+    params = [
+        param
+        for param in query.split("&")
+        if param and not param.startswith(WIDTH_PARAM + "=")
+    ]
+    if width != ORIGINAL:
+        params.append("%s=%d" % (WIDTH_PARAM, width))
+    return "%s?%s" % (base, "&".join(params)) if params else base
+
+
+def variantKey(key, width):
+    """
+    Builds the id a variant of an image is cached and saved under, so every variant
+    has its own file, its own --latest record and its own skip-if-exists check
+    :params: key - the id of the original, width - the width in pixels, ORIGINAL for
+    the original
+    :return: the id of the variant, the original keeps its own
+    """
+    if width == ORIGINAL:
+        return key
+    return "%s_w%d" % (key, width)
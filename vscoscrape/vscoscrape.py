@@ -1,35 +1,178 @@
 #!/usr/bin/env python3
 import argparse
 import concurrent.futures
-import os
 import json
+import multiprocessing
+import os
+import sys
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor
-from datetime import date
-import requests
+from datetime import datetime
 
 from tqdm import tqdm
 
 from . import constants
+from . import network
+from .archive import STORAGES
+from .archive import TarArchive
+from .checkpoint import DONE
+from .checkpoint import LISTED
+from .checkpoint import Checkpoint
+from .download import Bandwidth
+from .download import Downloader
+from .fileindex import IndexCache
+from .httpcache import MetadataCache
+from .manifest import Manifest
+from .mediastore import LINKS
+from .mediastore import MediaStore
+from .metrics import Metrics
+from .metrics import timedPhase
+from .records import MediaRecord
+from .scheduler import Scheduler
+from .scheduler import checked
+from .shard import LeaseTable
+from .shard import workerName
+from .store import StateStore
+from .variants import ORIGINAL
+from .variants import variantKey
+from .variants import variantUrl
+from .workqueue import IMAGE_BYTES
+from .workqueue import VIDEO_BYTES
+from .workqueue import WorkQueue
+
+# The StateStore used by --cacheHit and --latest, None when they're off
+cache = None
+latestCache = None
 
 
 class Scraper(object):
-    def __init__(self, username):
+    # Attributes that need the site id, resolved the first time one of them is read
+    SITE_ATTRIBUTES = (
+        "siteid",
+        "sitecollectionid",
+        "mediaurl",
+        "journalurl",
+        "collectionurl",
+        "profileurl",
+    )
+    # The listing url attribute and the json key holding the items of each kind
+    LISTINGS = {
+        "images": ("mediaurl", "media"),
+        "collection": ("collectionurl", "medias"),
+        "journal": ("journalurl", "articles"),
+    }
+
+    def __init__(
+        self,
+        username,
+        workers=5,
+        session=None,
+        downloader=None,
+        folder=None,
+        since=None,
+        page_size=100,
+        list_workers=5,
+        metadata=None,
+        site=None,
+        scheduler=None,
+        metrics=None,
+        manifest=False,
+        trust_manifest=False,
+        checkpoint=None,
+        small_slots=1,
+        variants=(ORIGINAL,),
+        storage="files",
+        archive_size=1024 * 1024 * 1024,
+    ):
         self.username = username
-        self.session = requests.Session()
-        self.session.get(
-            "http://vsco.co/content/Static/userinfo?callback=jsonp_%s_0"
-            % (str(round(time.time() * 1000))),
-            headers=constants.visituserinfo,
+        # The Checkpoint progress is recorded in, None to always start from the beginning
+        self.checkpoint = checkpoint
+        # Listing errors so far, a phase only counts as listed when it had none
+        self.listFailures = 0
+        # Media that failed to download so far
+        self.failures = 0
+        self.failLock = threading.Lock()
+        # The Metrics requests are counted in, None to not count them
+        self.metrics = metrics
+        self.phase = "sites"
+        self.siteLock = threading.Lock()
+        # The MetadataCache api responses go through, None to always fetch them in full
+        self.metadata = metadata
+        self.workers = workers
+        # Download workers that only take small items, so videos never hold all of them
+        self.smallSlots = small_slots
+        # The widths images are saved in, ORIGINAL for the file as uploaded
+        self.variants = variants
+        self.pageSize = page_size
+        self.listWorkers = list_workers
+        self.pageCount = None
+        self.pageRequests = 0
+        # Media uploaded before this millisecond timestamp is skipped, None for no cutoff
+        self.since = since
+        self.lastPage = None
+        self.pageLock = threading.Lock()
+        if session is None:
+            session = network.makeSession(workers)
+        self.session = session
+        # Every request waits for a Scheduler slot and is retried when it fails
+        if scheduler is None:
+            scheduler = Scheduler(workers + list_workers)
+        self.scheduler = scheduler
+        if downloader is None:
+            downloader = Downloader(self.session, scheduler=scheduler)
+        self.downloader = downloader
+        # Everything is saved under folder/username, folder defaults to the current one
+        self.folder = os.path.join(
+            folder if folder is not None else os.getcwd(), self.username
         )
-        path = os.path.join(os.getcwd(), self.username)
         # If the path doesn't exist, then create it
-        if not os.path.exists(path):
-            os.makedirs(path)
-        os.chdir(path)
-        self.newSiteId()
-        self.buildJSON()
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder, exist_ok=True)
+        # The Manifest media records are appended to, None to keep no manifest
+        self.manifest = None
+        if manifest or trust_manifest:
+            self.manifest = Manifest(self.folder)
+        # The TarArchive media is moved into once it's saved, None to keep loose files
+        self.archive = None
+        if storage == "tar":
+            self.archive = TarArchive(self.folder, archive_size)
+        # trust_manifest skips the directory scans, files count as on disk when the
+        # manifest says they were saved. An archive knows what it holds itself
+        if self.archive is not None:
+            self.indexes = IndexCache(self.archive)
+        else:
+            self.indexes = IndexCache(self.manifest if trust_manifest else None)
+        self.queue = None
         self.totalj = 0
+        # site is [site id, site collection id] when it's already known, e.g. from resolveSites
+        if site is not None:
+            self.siteid, self.sitecollectionid = site
+            self.buildJSON()
+
+    def __getattr__(self, name):
+        """
+        Looks up the site id the first time it or an api url is needed, so building
+        a Scraper doesn't make any requests
+        :params: name - the missing attribute
+        :return: the attribute once the site id is known
+        """
+        if name not in Scraper.SITE_ATTRIBUTES or "siteLock" not in self.__dict__:
+            raise AttributeError(name)
+        self.resolveSite()
+        return self.__dict__[name]
+
+    def resolveSite(self):
+        """
+        Looks up the site id and builds the api urls, unless that was already done
+        :params: none
+        :return: the site id
+        """
+        with self.siteLock:
+            if "siteid" not in self.__dict__ or "mediaurl" not in self.__dict__:
+                self.newSiteId()
+                self.buildJSON()
+        return self.siteid
 
     def newSiteId(self):
         """
@@ -38,32 +181,17 @@ class Scraper(object):
         :return: returns the site id of a user in case you were curious
         """
         global cache
-        global latestCache
 
-        if latestCache is not None:
-            if self.username not in latestCache:
-                latestCache[self.username] = {}
-                latestCache[self.username]["images"] = {}
-                latestCache[self.username]["collection"] = {}
-                latestCache[self.username]["journal"] = {}
-                latestCache[self.username]["profile"] = {}
-
-            elif "profile" not in latestCache[self.username]:
-                latestCache[self.username]["profile"] = {}
-
-        if cache is None or self.username not in cache:
-            res = self.session.get(
-                "http://vsco.co/api/2.0/sites?subdomain=%s"
-                % (self.username),
-                headers=constants.visituserinfo,
-            )
-            self.siteid = res.json()["sites"][0]["id"]
-            self.sitecollectionid = res.json()["sites"][0]["site_collection_id"]
+        cached = cache.getSite(self.username) if cache is not None else None
+        if cached is None:
+            res = self.getJson(siteUrl(self.username), headers=constants.visituserinfo)
+            self.siteid = res["sites"][0]["id"]
+            self.sitecollectionid = res["sites"][0]["site_collection_id"]
             if cache is not None:
-                cache[self.username] = [self.siteid, self.sitecollectionid]
+                cache.setSite(self.username, self.siteid, self.sitecollectionid)
         else:
-            self.siteid = cache[self.username][0]
-            self.sitecollectionid = cache[self.username][1]
+            self.siteid = cached[0]
+            self.sitecollectionid = cached[1]
         return self.siteid
 
     def buildJSON(self):
@@ -72,36 +200,215 @@ class Scraper(object):
         :params: none
         :return: returns the main media url by default
         """
-        self.mediaurl = "http://vsco.co/api/2.0/medias?site_id=%s" % (
-            self.siteid,
-        )
-        self.journalurl = "http://vsco.co/api/2.0/articles?site_id=%s" % (
-            self.siteid,
-        )
-        self.collectionurl = "http://vsco.co/api/2.0/collections/%s/medias?" % (
+        self.mediaurl = "%s/medias?site_id=%s" % (constants.api, self.siteid)
+        self.journalurl = "%s/articles?site_id=%s" % (constants.api, self.siteid)
+        self.collectionurl = "%s/collections/%s/medias?" % (
+            constants.api,
             self.sitecollectionid,
         )
-        self.profileurl = "http://vsco.co/api/2.0/sites/%s" % (self.siteid)
+        self.profileurl = "%s/sites/%s" % (constants.api, self.siteid)
         
         return self.mediaurl
 
+    def getJson(self, url, params=None, headers=constants.media):
+        """
+        Gets an api response, through the metadata cache when there is one
+        :params: url - the api url, params - the query parameters, headers - the headers
+        :return: the decoded json
+        """
+        began = time.monotonic()
+        if self.metadata is None:
+            data = self.scheduler.call(
+                lambda: checked(self.session.get(url, params=params, headers=headers)),
+                self.retried,
+            ).json()
+        else:
+            data = self.metadata.get(
+                self.session, url, params, headers, self.scheduler, self.retried
+            )
+        self.record("api_requests")
+        self.observe("api", began)
+        return data
+
+    def fetchMedia(self, url, path, resumable=False):
+        """
+        Downloads a media file, or links it from the media store when it's there,
+        counting it in the metrics and moving it into the archive when there is one
+        :params: url - the media url, path - where the finished file should end up,
+        resumable - keep partial data on failure and continue it with a Range request
+        :return: the number of bytes written
+        """
+        if self.downloader.place(url, path) is not None:
+            self.record("linked")
+            self.keep(path)
+            return 0
+        began = time.monotonic()
+        written = self.downloader.fetch(url, path, resumable, self.retried)
+        self.record("media_requests")
+        self.record("bytes", written)
+        self.observe("media", began)
+        self.keep(path)
+        return written
+
+    def keep(self, path):
+        """
+        Moves a file that was just saved into the archive, when there is one
+        :params: path - the file
+        :return: none
+        """
+        if self.archive is not None:
+            self.archive.add(path)
+
+    def record(self, key, amount=1):
+        """
+        Adds to a metrics counter of the user and the phase running
+        :params: key - the counter, amount - how much to add
+        :return: none
+        """
+        if self.metrics is not None:
+            self.metrics.count(self.username, self.phase, key, amount)
+
+    def listFailed(self):
+        """
+        Counts a listing request that failed
+        :params: none
+        :return: none
+        """
+        with self.failLock:
+            self.listFailures += 1
+        self.record("failures")
+
+    def downloadFailed(self):
+        """
+        Counts a media item that failed to download
+        :params: none
+        :return: none
+        """
+        with self.failLock:
+            self.failures += 1
+        self.record("failures")
+
+    def retried(self):
+        """
+        Counts a retry the scheduler is about to make
+        :params: none
+        :return: none
+        """
+        self.record("retries")
+
+    def observe(self, kind, began):
+        """
+        Records the latency of a request that just finished
+        :params: kind - "api" or "media", began - the time.monotonic() it started at
+        :return: none
+        """
+        if self.metrics is not None:
+            self.metrics.observe(kind, time.monotonic() - began)
+
+    def markDone(self, kind, key, path=None, existing=False):
+        """
+        Records a media item as seen for --latest and as saved in the manifest once it's on disk
+        :params: kind - the latestCache section, key - the id the item is cached under,
+        path - the file it's saved in, existing - the file was already there when it was
+        listed, so it was never queued and the checkpoint has nothing to record
+        :return: none
+        """
+        if latestCache is not None:
+            latestCache.markSeen(self.username, kind, key)
+        if self.checkpoint is not None and not existing:
+            self.checkpoint.done(self.username, kind, key)
+        if self.manifest is not None and path is not None:
+            size = None
+            if self.archive is not None:
+                size = self.archive.sizeOf(path)
+            self.manifest.addSaved(kind, str(key), path, size)
+
+    def noteListed(self, kind, key, **fields):
+        """
+        Records what the api said about a media item in the manifest
+        :params: kind - the latestCache section, key - the id the item is cached under,
+        fields - the rest of the record
+        :return: none
+        """
+        if self.manifest is not None:
+            self.manifest.addListed(kind, str(key), **fields)
+
+    def noteQueued(self, key, item):
+        """
+        Records an item handed to the downloads in the checkpoint
+        :params: key - the id the item is cached under, item - what was queued
+        :return: none
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.queued(self.username, self.phase, key, item)
+
+    def phaseState(self):
+        """
+        Looks up how far an earlier try of this run got with the running phase
+        :params: none
+        :return: LISTED, DONE, or None to start it from the beginning
+        """
+        if self.checkpoint is None:
+            return None
+        state = self.checkpoint.phaseState(self.username, self.phase)
+        if state == DONE:
+            print("%s of %s was finished by an earlier try" % (self.phase, self.username))
+        return state
+
+    def setPhase(self, state):
+        """
+        Records how far the running phase got in the checkpoint
+        :params: state - LISTED or DONE
+        :return: none
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.setPhase(self.username, self.phase, state)
+
+    def requeue(self):
+        """
+        Hands the items an earlier try queued but never saved to the download workers
+        :params: none
+        :return: none
+        """
+        for item in self.checkpoint.unfinished(self.username, self.phase):
+            self.queue.put(item, self.expectedSize(item))
+
+    def flushManifest(self):
+        """
+        Writes the manifest records still held in memory
+        :params: none
+        :return: none
+        """
+        if self.manifest is not None:
+            self.manifest.flush()
+
+    def dirIndex(self, path=None):
+        """
+        Gets the shared file index of a directory
+        :params: path - the directory, defaults to the user's folder
+        :return: the DirIndex of the directory
+        """
+        return self.indexes.get(path if path is not None else self.folder)
+
+    @timedPhase("profile")
     def getProfile(self):
         """
         Downloads the profile pictures for the user
         :params: none
         :return: none
         """
+        if self.phaseState() == DONE:
+            return
         self.imagelist = []
-        path = os.path.join(os.getcwd(), "profile")
+        path = os.path.join(self.folder, "profile")
         if not os.path.exists(path):
-            os.makedirs(path)
-        os.chdir(path)
-        
+            os.makedirs(path, exist_ok=True)
+
         self.pbar = tqdm(
             desc="Finding if a new profile picture exists from %s" % self.username, unit=" post"
         )
 
-        self.makeProfileList()
+        self.makeProfileList(path)
 
         self.pbar.close()
 
@@ -110,54 +417,302 @@ class Scraper(object):
                 desc="Downloading a new profile picture from %s" % self.username,
                 unit=" post",
             )
+        failed = False
         for lists in self.imagelist:
           try:
-            self.download_img_normal(lists)
+            self.download_img_normal(lists, path, "profile")
           except Exception as exc:
+            failed = True
+            self.downloadFailed()
             print("%s crached %s" %(self.username, exc))
           self.pbar.update()
         self.pbar.close()
-        os.chdir("..")
-        
-    def makeProfileList(self):
+        self.flushManifest()
+        if not failed:
+            self.setPhase(DONE)
+
+    def makeProfileList(self, folder=None):
         """
         Creates a list holding data on the profile picture 
-        :params: none
+        :params: folder - the profile folder, defaults to profile in the user's folder
         :return: a boolean on whether the list was successfully made
         """
-        global latestCache
-        url = self.session.get(
-            self.profileurl
-        , headers=constants.media).json()["site"]
+        if folder is None:
+            folder = os.path.join(self.folder, "profile")
+        url = self.getJson(self.profileurl)["site"]
+        return self.addProfile(url, self.dirIndex(folder))
 
-        if latestCache is not None:
-            if (
-                url["profile_image_id"]
-                in latestCache[self.username]["profile"]
-            ):
-                return True
+    def imageVariants(self, key, url):
+        """
+        Lists the files an image is saved as, one for every width asked for
+        :params: key - the id of the original, url - the url of the original
+        :return: a list of [key, url] of every variant
+        """
+        return [
+            [variantKey(key, width), variantUrl(url, width)] for width in self.variants
+        ]
+
+    def mediaRecords(self, url, kind):
+        """
+        Builds the records of the files a media item is saved as, one per image variant
+        :params: url - the media item from the api, kind - "images" or "collection"
+        :return: a list of MediaRecords
+        """
+        stem = str(url["upload_date"])[:-3]
+        if url["is_video"] is True:
+            entries = [[stem, "http://%s" % url["video_url"]]]
+        else:
+            entries = self.imageVariants(stem, "http://%s" % url["responsive_url"])
+        return [
+            MediaRecord(
+                kind,
+                key,
+                link,
+                "%s%s%s"
+                % (
+                    "" if kind == "images" else kind + "/",
+                    key,
+                    ".mp4" if url["is_video"] is True else ".jpg",
+                ),
+                url["is_video"] is True,
+                url["upload_date"],
+                url.get("_id"),
+                url.get("width"),
+                url.get("height"),
+                None,
+            )
+            for key, link in entries
+        ]
+
+    def articleRecords(self, article):
+        """
+        Builds the records of the files the body of an article is saved as
+        :params: article - the article from the api
+        :return: a list of MediaRecords, text, images and videos in body order
+        """
+        folder = "journal/%s/" % article["permalink"]
+        records = []
+        for item in article["body"]:
+            if item["type"] == "text":
+                key = "%s.txt" % str(item["content"])
+                records.append(
+                    MediaRecord(
+                        "journal",
+                        key,
+                        None,
+                        folder + key,
+                        False,
+                        None,
+                        None,
+                        None,
+                        None,
+                        item["content"],
+                    )
+                )
+                continue
+            if item["type"] == "image":
+                entries = self.imageVariants(
+                    str(item["content"][0]["id"]),
+                    "http://%s" % item["content"][0]["responsive_url"],
+                )
+            elif item["type"] == "video":
+                entries = [
+                    [
+                        str(item["content"][0]["id"]),
+                        "http://%s" % item["content"][0]["video_url"],
+                    ]
+                ]
             else:
-                latestCache[self.username]["profile"][
-                    url["profile_image_id"]
-                ] = date.today().strftime("%m-%d-%Y")
-        if (
-            url["profile_image_id"] == None or
-            "%s.jpg" % url["profile_image_id"] in os.listdir()
-        ):
-            return True
+                continue
+            for key, link in entries:
+                records.append(
+                    MediaRecord(
+                        "journal",
+                        key,
+                        link,
+                        "%s%s%s"
+                        % (folder, key, ".mp4" if item["type"] == "video" else ".jpg"),
+                        item["type"] == "video",
+                        None,
+                        item["content"][0].get("id"),
+                        item["content"][0].get("width"),
+                        item["content"][0].get("height"),
+                        None,
+                    )
+                )
+        return records
 
-        self.imagelist.append(
-            [
-                "http://%s" % url["responsive_url"],
-                url["profile_image_id"],
+    def profileRecords(self, site):
+        """
+        Builds the records of the files the current profile picture is saved as
+        :params: site - the site data of the user
+        :return: a list of MediaRecords, empty without a profile picture
+        """
+        if site["profile_image_id"] is None:
+            return []
+        return [
+            MediaRecord(
+                "profile",
+                key,
+                link,
+                "profile/%s.jpg" % key,
                 False,
-            ]
-        )
+                None,
+                site["profile_image_id"],
+                None,
+                None,
+                None,
+            )
+            for key, link in self.imageVariants(
+                site["profile_image_id"], "http://%s" % site["responsive_url"]
+            )
+        ]
 
-        self.pbar.update()
+    def iter_media(self, kind="images"):
+        """
+        Lists the media of the user page by page, yielding a MediaRecord for every
+        file it would be saved as
+
+        Nothing is skipped for being cached or saved, nothing is drawn, and the
+        listing itself doesn't read or write the disk, so the records can go to
+        save_media or anywhere else. Only the api page being read is held in memory.
+        self.since ends images at the first older upload and leaves older collection
+        posts out. The first request is made when the first record is asked for.
+
+        :params: kind - "images", "collection", "journal" or "profile"
+        :return: a generator of MediaRecords
+        """
+        if kind != "profile" and kind not in Scraper.LISTINGS:
+            raise ValueError(
+                'kind must be "images", "collection", "journal" or "profile"'
+            )
+        return self.iterMedia(kind)
+
+    def iterMedia(self, kind):
+        """
+        The generator behind iter_media, for a kind that was already checked
+        :params: kind - "images", "collection", "journal" or "profile"
+        :return: a generator of MediaRecords
+        """
+        if kind == "profile":
+            for record in self.profileRecords(self.getJson(self.profileurl)["site"]):
+                yield record
+            return
+        attribute, key = Scraper.LISTINGS[kind]
+        url = getattr(self, attribute)
+        num = 1
+        while True:
+            items = self.getJson(url, params={"size": self.pageSize, "page": num})[key]
+            for item in items:
+                if kind == "journal":
+                    records = self.articleRecords(item)
+                elif self.since is not None and item["upload_date"] < self.since:
+                    # Collections are ordered by when a post was collected
+                    if kind == "images":
+                        return
+                    continue
+                else:
+                    records = self.mediaRecords(item, kind)
+                for record in records:
+                    yield record
+            # A page that isn't full is the last one
+            if len(items) < self.pageSize:
+                return
+            num += 1
+
+    def save_media(self, records):
+        """
+        Saves MediaRecords, from iter_media or anywhere else, in the usual layout
+
+        self.workers threads download while the records are still being read, the
+        smallest expected first like Scraper.pipeline, files already saved are
+        skipped and saved ones are recorded for --latest, the checkpoint and the
+        manifest.
+
+        :params: records - any iterable of MediaRecords
+        :return: a list of the records that failed
+        """
+        failed = []
+        work = WorkQueue(maxsize=self.workers * 4)
+
+        def consume(small_only):
+            while True:
+                record = work.get(small_only)
+                if record is None:
+                    return
+                try:
+                    self.saveRecord(record)
+                except Exception as exc:
+                    failed.append(record)
+                    self.downloadFailed()
+                    print("%r crashed %s" % (record.name, exc))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            reserved = min(self.smallSlots, self.workers - 1)
+            for slot in range(self.workers):
+                executor.submit(consume, slot < reserved)
+            try:
+                for record in records:
+                    work.put(record, self.expectedSize(record))
+            finally:
+                work.close()
+        self.flushManifest()
+        return failed
+
+    def saveRecord(self, record):
+        """
+        Saves one MediaRecord unless it's already saved
+        :params: record - the MediaRecord
+        :return: none
+        """
+        path = os.path.join(self.folder, *record.name.split("/"))
+        folder, name = os.path.split(path)
+        os.makedirs(folder, exist_ok=True)
+        index = self.dirIndex(folder)
+        existing = index.has(name)
+        if existing:
+            self.record("skipped_file")
+        elif record.text is not None:
+            self.downloader.writeText(record.text, path)
+            self.keep(path)
+        else:
+            self.fetchMedia(record.url, path, resumable=record.is_video)
+        index.add(name)
+        self.markDone(record.kind, record.key, path, existing)
+
+    def addProfile(self, url, index):
+        """
+        Adds the current profile picture to the download list unless it's cached or on disk
+        :params: url - the site data of the user, index - the DirIndex of the profile folder
+        :return: a boolean on whether the list was successfully made
+        """
+        global latestCache
+        for record in self.profileRecords(url):
+            key, link = record.key, record.url
+            if latestCache is not None:
+                if latestCache.isSeen(self.username, "profile", key):
+                    self.record("skipped_cache")
+                    continue
+            self.noteListed("profile", key, url=link)
+            if index.has("%s.jpg" % key):
+                self.record("skipped_file")
+                self.markDone(
+                    "profile",
+                    key,
+                    os.path.join(index.path, "%s.jpg" % key),
+                    existing=True,
+                )
+                continue
+
+            lists = [link, key, False]
+            self.noteQueued(key, lists)
+            self.imagelist.append(lists)
+
+            self.pbar.update()
       
         return True
 
+    @timedPhase("collection")
     def getCollection(self):
         """
         Downloads the collection posts from the user
@@ -165,281 +720,213 @@ class Scraper(object):
         :return: none
         """
         self.imagelist = []
-        path = os.path.join(os.getcwd(), "collection")
+        path = os.path.join(self.folder, "collection")
         if not os.path.exists(path):
-            os.makedirs(path)
-        os.chdir(path)
-        self.getCollectionList()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            future_to_url = {
-                executor.submit(self.download_img_normal, lists): lists
-                for lists in self.imagelist
-            }
-            for future in tqdm(
-                concurrent.futures.as_completed(future_to_url),
-                total=len(self.imagelist),
-                desc="Downloading collection posts from %s" % self.username,
-                unit=" posts",
-            ):
-                liste = future_to_url[future]
-                try:
-                    data = future.result()
-                except Exception as exc:
-                    print("%r crashed %s" % (liste, exc))
-        os.chdir("..")
+            os.makedirs(path, exist_ok=True)
+        self.pipeline(
+            lambda: self.getCollectionList(path),
+            lambda lists: self.download_img_normal(lists, path, "collection"),
+            "Downloading collection posts from %s" % self.username,
+        )
 
-    def getCollectionList(self):
+    def getCollectionList(self, folder=None):
         """
         Starts setting up to download the collection
 
         Does magical stuff with the concurrent future
-        :params: none
+        :params: folder - the collection folder, defaults to collection in the user's folder
         :return: none
         """
+        if folder is None:
+            folder = os.path.join(self.folder, "collection")
         self.pbar = tqdm(
             desc="Finding new collection posts from %s" % self.username, unit=" posts"
         )
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            future_to_url = {
-                executor.submit(self.makeCollectionList, num): num for num in range(5)
-            }
-            for future in concurrent.futures.as_completed(future_to_url):
-                num = future_to_url[future]
-                try:
-                    data = future.result()
-                except Exception as exc:
-                    print("%r crashed %s" % (num, exc))
+        self.listPages(self.collectionurl, "medias", "collection", folder)
         self.pbar.close()
 
-    def makeCollectionList(self, num):
+    def makeCollectionList(self, num, folder=None):
         """
         Determines what file type a media item is, then appends the correct url
-        :params: num - this does some magic, no idea why it works or why I did it
-        :return: a boolean on whether the list was successfully made
+        :params: num - the page to list, counting from 0,
+        folder - the collection folder, defaults to collection in the user's folder
+        :return: a boolean on whether the pages after this one should be listed
         """
-        global latestCache
-        num += 1
-        z = self.session.get(
-            self.collectionurl,
-            params={"size": 100, "page": num},
-            headers=constants.media,
-        ).json()["medias"]
-
-        count = len(z)
-        while count > 0:
-            for url in z:
-                if latestCache is not None:
-                    if (
-                        str(url["upload_date"])[:-3]
-                        in latestCache[self.username]["collection"]
-                    ):
-                        continue
-                    else:
-                        latestCache[self.username]["collection"][
-                            str(url["upload_date"])[:-3]
-                        ] = date.today().strftime("%m-%d-%Y")
-                if (
-                    "%s.jpg" % str(url["upload_date"])[:-3] in os.listdir()
-                    or "%s.mp4" % str(url["upload_date"])[:-3] in os.listdir()
-                ):
-                    continue
-                if url["is_video"] is True:
-                    self.imagelist.append(
-                        [
-                            "http://%s" % url["video_url"],
-                            str(url["upload_date"])[:-3],
-                            True,
-                        ]
-                    )
-                    self.pbar.update()
-                else:
-                    self.imagelist.append(
-                        [
-                            "http://%s" % url["responsive_url"],
-                            str(url["upload_date"])[:-3],
-                            False,
-                        ]
-                    )
-                    self.pbar.update()
-            num += 5
-            z = self.session.get(
-                self.collectionurl,
-                params={"size": 100, "page": num},
-                headers=constants.media,
-            ).json()["medias"]
-            count = len(z)
-        return True
+        if folder is None:
+            folder = os.path.join(self.folder, "collection")
+        return self.listPage(
+            self.collectionurl, "medias", "collection", self.dirIndex(folder), num + 1
+        )
 
+    @timedPhase("journal")
     def getJournal(self):
         """
         Downloads the journal posts from the user
         :params: none
         :return: none
         """
-        self.getJournalList()
-        self.progbarj = tqdm(
-            total=self.totalj,
-            desc="Downloading journal posts from %s" % self.username,
-            unit=" posts",
+        folder = os.path.join(self.folder, "journal")
+        self.pipeline(
+            lambda: self.getJournalList(folder),
+            lambda entry: self.download_img_journal(entry[1], entry[0]),
+            "Downloading journal posts from %s" % self.username,
         )
-        for x in self.works:
-            path = os.path.join(os.getcwd(), x[0])
-            if not os.path.exists(path):
-                os.makedirs(path)
-            os.chdir(path)
-            x.pop(0)
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                future_to_url = {
-                    executor.submit(self.download_img_journal, part): part for part in x
-                }
-                for future in concurrent.futures.as_completed(future_to_url):
-                    part = future_to_url[future]
-                    try:
-                        data = future.result()
-                    except Exception as exc:
-                        print("%r crashed %s" % (part, exc))
-            os.chdir(os.path.normpath(os.getcwd() + os.sep + os.pardir))
-        self.progbarj.close()
-
-    def getJournalList(self):
-        """
-        Opens initial journal data of a user and creates the journal folder
-
-        Then it does some magical bs, I made this years ago no idea how it works
 
-        :params: none
+    def getJournalList(self, folder=None):
+        """
+        Creates the journal folder and lists the articles of a user
+
+        Articles are paged through like media, self.pageSize at a time, and each page
+        is let go of once its items are queued, so a prolific journal never sits in
+        memory as a whole.
+
+        :params: folder - the journal folder, defaults to journal in the user's folder
         :return: none
         """
+        if folder is None:
+            folder = os.path.join(self.folder, "journal")
         self.works = []
-        self.jour_found = self.session.get(
-            self.journalurl, params={"size": 10000, "page": 1}, headers=constants.media
-        ).json()["articles"]
-        self.pbarjlist = tqdm(
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.pbar = tqdm(
             desc="Finding new journal posts from %s" % self.username, unit=" posts"
         )
-        for x in self.jour_found:
-            self.works.append([x["permalink"]])
-        path = os.path.join(os.getcwd(), "journal")
-        if not os.path.exists(path):
-            os.makedirs(path)
-        os.chdir(path)
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            future_to_url = {
-                executor.submit(self.makeListJournal, len(self.jour_found), val): val
-                for val in range(len(self.jour_found))
-            }
-            for future in concurrent.futures.as_completed(future_to_url):
-                val = future_to_url[future]
-                try:
-                    data = future.result()
-                except Exception as exc:
-                    print("%r crashed %s" % (val, exc))
-        self.pbarjlist.close()
+        self.listPages(self.journalurl, "articles", "journal", folder)
+        self.pbar.close()
+
+    def addArticles(self, articles, index):
+        """
+        Adds the body items of one api page of articles to the download list
+        :params: articles - the articles of the page, index - the DirIndex of the journal folder
+        :return: none
+        """
+        for article in articles:
+            try:
+                self.addArticle(article, index.path)
+            except Exception as exc:
+                self.listFailed()
+                print("%r crashed %s" % (article.get("permalink"), exc))
 
-    def makeListJournal(self, num, loc):
+    def addArticle(self, article, folder=None):
         """
-        Makes the list of all journal entries on the users page
-        :params: num, loc
+        Adds the body items of one article to the download list, skipping anything
+        cached or on disk
+        :params: article - the article, folder - the journal folder, defaults to
+        journal in the user's folder
         :return: a boolean on whether the journal media was able to be grabbed
         """
         global latestCache
-        for item in self.jour_found[loc]["body"]:
+        if folder is None:
+            folder = os.path.join(self.folder, "journal")
+        path = os.path.join(folder, article["permalink"])
+        # One snapshot of the article folder serves every item in it
+        index = self.dirIndex(path)
+        for record in self.articleRecords(article):
+            name = record.name.split("/")[-1]
+            if record.text is not None:
+                self.noteListed(
+                    "journal", record.key, permalink=article["permalink"], type="text"
+                )
+            else:
+                self.noteListed(
+                    "journal",
+                    record.key,
+                    permalink=article["permalink"],
+                    type="video" if record.is_video else "image",
+                    is_video=record.is_video,
+                    url=record.url,
+                )
             if latestCache is not None:
-                if item["type"] == "text":
-                    if (
-                        "%s.txt" % str(item["content"])
-                        in latestCache[self.username]["journal"]
-                    ):
-                        continue
-                    else:
-                        latestCache[self.username]["images"][
-                            "%s.txt" % str(item["content"])
-                        ] = date.today().strftime("%m-%d-%Y")
-                else:
-                    if (
-                        str(item["content"][0]["id"])
-                        in latestCache[self.username]["journal"]
-                    ):
-                        continue
-                    else:
-                        latestCache[self.username]["journal"][
-                            str(item["content"][0]["id"])
-                        ] = date.today().strftime("%m-%d-%Y")
+                if latestCache.isSeen(self.username, "journal", record.key):
+                    self.record("skipped_cache")
+                    continue
 
-            if item["type"] == "image":
-                if os.path.exists(
-                    os.path.join(os.getcwd(), self.jour_found[loc]["permalink"])
-                ):
-                    if "%s.jpg" % str(item["content"][0]["id"]) in os.listdir(
-                        os.path.join(os.getcwd(), self.jour_found[loc]["permalink"])
-                    ):
-                        continue
-                self.works[loc].append(
-                    [
-                        "http://%s" % item["content"][0]["responsive_url"],
-                        item["content"][0]["id"],
-                        "img",
-                    ]
+            if index.has(name):
+                self.record("skipped_file")
+                self.markDone(
+                    "journal", record.key, os.path.join(path, name), existing=True
                 )
-            elif item["type"] == "video":
-                if os.path.exists(
-                    os.path.join(os.getcwd(), self.jour_found[loc]["permalink"])
-                ):
-                    if "%s.mp4" % str(item["content"][0]["id"]) in os.listdir(
-                        os.path.join(os.getcwd(), self.jour_found[loc]["permalink"])
-                    ):
-                        continue
-                self.works[loc].append(
-                    [
-                        "http://%s" % item["content"][0]["video_url"],
-                        item["content"][0]["id"],
-                        "vid",
-                    ]
+                continue
+            if record.text is not None:
+                self.enqueueJournal(path, [record.text, "txt"])
+            else:
+                self.enqueueJournal(
+                    path, [record.url, record.key, "vid" if record.is_video else "img"]
                 )
-            elif item["type"] == "text":
-                if os.path.exists(
-                    os.path.join(os.getcwd(), self.jour_found[loc]["permalink"])
-                ):
-                    if "%s.txt" % str(item["content"]) in os.listdir(
-                        os.path.join(os.getcwd(), self.jour_found[loc]["permalink"])
-                    ):
-                        continue
-                self.works[loc].append([item["content"], "txt"])
             self.totalj += 1
-            self.pbarjlist.update()
+            self.pbar.update()
         return True
 
-    def download_img_journal(self, lists):
+    def enqueueJournal(self, path, lists):
+        """
+        Hands a journal item to the download workers, or keeps it in self.works
+        as [path, item] when nothing is downloading yet
+        :params: path - the article folder, lists - the item
+        :return: none
+        """
+        self.noteQueued(
+            "%s.txt" % str(lists[0]) if lists[1] == "txt" else lists[1], [path, lists]
+        )
+        if self.queue is not None:
+            self.queue.put([path, lists], self.expectedSize([path, lists]))
+        else:
+            self.works.append([path, lists])
+
+    def download_img_journal(self, lists, folder=None):
         """
         Downloads the journal media in specified ways depending on the type of media
 
         Since Journal items can be text files, images, or videos, I had to make 3
         different ways of downloading
 
-        :params: lists - No idea why I named it this, but it's a media item
+        :params: lists - No idea why I named it this, but it's a media item,
+        folder - the article folder
         :return: a boolean on whether the journal media was able to be downloaded
         """
+        if folder is None:
+            folder = os.path.join(self.folder, "journal")
+        if not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        index = self.dirIndex(folder)
         if lists[1] == "txt":
-            with open("%s.txt" % str(lists[0]), "w") as f:
-                f.write(lists[0])
-        if lists[2] == "img":
-            if "%s.jpg" % lists[1] in os.listdir():
-                return True
-            with open("%s.jpg" % str(lists[1]), "wb") as f:
-                f.write(requests.get(lists[0], stream=True).content)
+            self.downloader.writeText(
+                lists[0], os.path.join(folder, "%s.txt" % str(lists[0]))
+            )
+            self.keep(os.path.join(folder, "%s.txt" % str(lists[0])))
+            index.add("%s.txt" % str(lists[0]))
+            self.markDone(
+                "journal",
+                "%s.txt" % str(lists[0]),
+                os.path.join(folder, "%s.txt" % str(lists[0])),
+            )
+        elif lists[2] == "img":
+            if index.has("%s.jpg" % lists[1]):
+                self.record("skipped_file")
+            else:
+                self.fetchMedia(
+                    lists[0], os.path.join(folder, "%s.jpg" % str(lists[1]))
+                )
+                index.add("%s.jpg" % lists[1])
+            self.markDone(
+                "journal", lists[1], os.path.join(folder, "%s.jpg" % str(lists[1]))
+            )
 
         elif lists[2] == "vid":
-            if "%s.mp4" % lists[1] in os.listdir():
-                return True
-            with open("%s.mp4" % str(lists[1]), "wb") as f:
-                for chunk in requests.get(lists[0], stream=True).iter_content(
-                    chunk_size=1024
-                ):
-                    if chunk:
-                        f.write(chunk)
-        self.progbarj.update()
+            if index.has("%s.mp4" % lists[1]):
+                self.record("skipped_file")
+            else:
+                self.fetchMedia(
+                    lists[0],
+                    os.path.join(folder, "%s.mp4" % str(lists[1])),
+                    resumable=True,
+                )
+                index.add("%s.mp4" % lists[1])
+            self.markDone(
+                "journal", lists[1], os.path.join(folder, "%s.mp4" % str(lists[1]))
+            )
         return True
 
+    @timedPhase("images")
     def getImages(self):
         """
         Makes a list of all media items in a page
@@ -451,23 +938,98 @@ class Scraper(object):
         :return: none
         """
         self.imagelist = []
-        self.getImageList()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            future_to_url = {
-                executor.submit(self.download_img_normal, lists): lists
-                for lists in self.imagelist
-            }
-            for future in tqdm(
-                concurrent.futures.as_completed(future_to_url),
-                total=len(self.imagelist),
-                desc="Downloading posts from %s" % self.username,
-                unit=" posts",
-            ):
-                liste = future_to_url[future]
+        self.pipeline(
+            self.getImageList,
+            self.download_img_normal,
+            "Downloading posts from %s" % self.username,
+        )
+
+    def pipeline(self, lister, download, desc):
+        """
+        Runs a listing and its downloads at the same time
+
+        The listing puts items on a bounded queue that self.workers threads take from,
+        so the first download starts after the first page and a full queue makes the
+        listing wait instead of piling the whole account up in memory. The queue hands
+        out the smallest expected item first, and self.smallSlots of the threads only
+        take small ones, so a run of videos can't hold up the images behind them.
+
+        With a checkpoint, a phase an earlier try finished is skipped and one it
+        listed only gets the items it left downloaded.
+
+        :params: lister - fills the queue through enqueue, download - takes one item,
+        desc - the progress bar text
+        :return: none
+        """
+        state = self.phaseState()
+        if state == DONE:
+            return
+        if state == LISTED:
+            lister = self.requeue
+        listFailures = self.listFailures
+        failed = []
+        self.queue = WorkQueue(maxsize=self.workers * 4)
+        bar = tqdm(desc=desc, unit=" posts")
+
+        def consume(small_only):
+            while True:
+                lists = self.queue.get(small_only)
+                if lists is None:
+                    return
                 try:
-                    data = future.result()
+                    download(lists)
                 except Exception as exc:
-                    print("%r crashed %s" % (liste, exc))
+                    failed.append(lists)
+                    self.downloadFailed()
+                    print("%r crashed %s" % (lists, exc))
+                bar.update()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            reserved = min(self.smallSlots, self.workers - 1)
+            for slot in range(self.workers):
+                executor.submit(consume, slot < reserved)
+            try:
+                lister()
+                if self.listFailures == listFailures:
+                    self.setPhase(LISTED)
+            finally:
+                self.queue.close()
+        self.queue = None
+        bar.close()
+        self.flushManifest()
+        if not failed and self.listFailures == listFailures:
+            self.setPhase(DONE)
+
+    def expectedSize(self, item):
+        """
+        Guesses how many bytes an item downloads, nothing tells before it starts
+        :params: item - a media item, [path, item] for a journal item, or a MediaRecord
+        :return: the expected size in bytes
+        """
+        if isinstance(item, MediaRecord):
+            if item.text is not None:
+                return len(item.text)
+            return VIDEO_BYTES if item.is_video else IMAGE_BYTES
+        if isinstance(item[1], list):
+            item = item[1]
+        if item[1] == "txt":
+            return len(item[0])
+        if item[2] is True or item[2] == "vid":
+            return VIDEO_BYTES
+        return IMAGE_BYTES
+
+    def enqueue(self, lists):
+        """
+        Hands a media item to the download workers, or keeps it in self.imagelist
+        when nothing is downloading yet
+        :params: lists - the media item
+        :return: none
+        """
+        self.noteQueued(lists[1], lists)
+        if self.queue is not None:
+            self.queue.put(lists, self.expectedSize(lists))
+        else:
+            self.imagelist.append(lists)
 
     def getImageList(self):
         """
@@ -477,16 +1039,7 @@ class Scraper(object):
         :return: none
         """
         self.pbar = tqdm(desc="Finding new posts from %s" % self.username, unit=" posts")
-        with ThreadPoolExecutor(max_workers=5) as executor:
-            future_to_url = {
-                executor.submit(self.makeImageList, num): num for num in range(5)
-            }
-            for future in concurrent.futures.as_completed(future_to_url):
-                num = future_to_url[future]
-                try:
-                    data = future.result()
-                except Exception as exc:
-                    print("%r crashed %s" % (num, exc))
+        self.listPages(self.mediaurl, "media", "images", self.folder)
         self.pbar.close()
 
     def makeImageList(self, num):
@@ -496,60 +1049,183 @@ class Scraper(object):
 
         Don't ask me how it works, frankly I'm surprised it does
 
-        :params: num - I remember looking at this after starting to merge the prs and wondering why I did num += 5. Still couldn't tell you.
-        :return: a boolean on whether the journal media was able to be grabbed
+        :params: num - the page to list, counting from 0. It used to walk every fifth page, now listPages hands out the pages.
+        :return: a boolean on whether the pages after this one should be listed
         """
-        global latestCache
-        num += 1
-        z = self.session.get(
-            self.mediaurl, params={"size": 100, "page": num}, headers=constants.media
-        ).json()["media"]
-        count = len(z)
-        while count > 0:
-            for url in z:
-                if latestCache is not None:
-                    if (
-                        str(url["upload_date"])[:-3]
-                        in latestCache[self.username]["images"]
-                    ):
-                        continue
-                    else:
-                        latestCache[self.username]["images"][
-                            str(url["upload_date"])[:-3]
-                        ] = date.today().strftime("%m-%d-%Y")
-                if (
-                    "%s.jpg" % str(url["upload_date"])[:-3] in os.listdir()
-                    or "%s.mp4" % str(url["upload_date"])[:-3] in os.listdir()
-                ):
-                    continue
-                if url["is_video"] is True:
-                    self.imagelist.append(
-                        [
-                            "http://%s" % url["video_url"],
-                            str(url["upload_date"])[:-3],
-                            True,
-                        ]
+        return self.listPage(self.mediaurl, "media", "images", self.dirIndex(), num + 1)
+
+    def listPages(self, url, key, kind, folder):
+        """
+        Lists every page of a media listing
+
+        Page 1 is fetched on its own. When it carries a total, exactly the pages that
+        total needs are fetched, self.listWorkers at a time. Without one, page 2 is
+        fetched alone and the window doubles, up to twice self.listWorkers, as long as
+        every page comes back full, so a small account costs no extra requests.
+
+        :params: url - the listing url, key - the json key holding the media or
+        articles, kind - the latestCache section, folder - where the media is saved
+        :return: none
+        """
+        index = self.dirIndex(folder)
+        self.lastPage = None
+        self.pageCount = None
+        self.pageRequests = 0
+        if self.tryListPage(url, key, kind, index, 1):
+            with ThreadPoolExecutor(max_workers=self.listWorkers) as executor:
+                if self.pageCount is not None:
+                    pages = range(2, self.pageCount + 1)
+                    list(
+                        executor.map(
+                            lambda num: self.tryListPage(url, key, kind, index, num),
+                            pages,
+                        )
                     )
-                    self.pbar.update()
                 else:
-                    self.imagelist.append(
-                        [
-                            "http://%s" % url["responsive_url"],
-                            str(url["upload_date"])[:-3],
-                            False,
-                        ]
-                    )
-                    self.pbar.update()
-            num += 5
-            z = self.session.get(
-                self.mediaurl,
-                params={"size": 100, "page": num},
-                headers=constants.media,
-            ).json()["media"]
-            count = len(z)
-        return True
+                    start, window = 2, 1
+                    while True:
+                        pages = range(start, start + window)
+                        more = executor.map(
+                            lambda num: self.tryListPage(url, key, kind, index, num),
+                            pages,
+                        )
+                        if not all(list(more)):
+                            break
+                        start += window
+                        window = min(window * 2, self.listWorkers * 2)
+        self.pbar.set_postfix(pages=self.pageRequests)
+
+    def tryListPage(self, url, key, kind, index, num):
+        """
+        Lists one api page, printing the error instead of raising it
+        :params: url - the listing url, key - the json key holding the media,
+        kind - the latestCache section, index - the DirIndex of the folder, num - the page
+        :return: a boolean on whether the pages after this one should be listed
+        """
+        try:
+            return self.listPage(url, key, kind, index, num)
+        except Exception as exc:
+            self.listFailed()
+            print("%r crashed %s" % (num, exc))
+            return False
 
-    def download_img_normal(self, lists):
+    def incremental(self):
+        """
+        Tells if listing can stop early, which is the case with --latest or --since
+        :params: none
+        :return: a boolean
+        """
+        return latestCache is not None or self.since is not None
+
+    def stopAt(self, num):
+        """
+        Marks a page as holding only known or too old media. Media comes newest first,
+        so every page after it is skipped
+        :params: num - the page number
+        :return: none
+        """
+        with self.pageLock:
+            if self.lastPage is None or num < self.lastPage:
+                self.lastPage = num
+
+    def listPage(self, url, key, kind, index, num):
+        """
+        Lists one api page of media
+        :params: url - the listing url, key - the json key holding the media,
+        kind - the latestCache section, index - the DirIndex of the folder, num - the page
+        :return: a boolean on whether the pages after this one should be listed
+        """
+        if self.lastPage is not None and num > self.lastPage:
+            return False
+        data = self.getJson(url, params={"size": self.pageSize, "page": num})
+        return self.pageDone(data, key, kind, index, num)
+
+    def pageDone(self, data, key, kind, index, num):
+        """
+        Adds the media of a fetched page and decides if listing goes on
+        :params: data - the json of the page, key - the json key holding the media,
+        kind - the latestCache section, index - the DirIndex of the folder, num - the page
+        :return: a boolean on whether the pages after this one should be listed
+        """
+        z = data[key]
+        with self.pageLock:
+            self.pageRequests += 1
+            if num == 1 and isinstance(data.get("total"), int):
+                self.pageCount = -(-data["total"] // self.pageSize)
+        if len(z) == 0:
+            return False
+        if kind == "journal":
+            # Articles have no upload date to stop at, every page is listed
+            self.addArticles(z, index)
+            return len(z) >= self.pageSize
+        if self.addMedia(z, kind, index) == 0 and self.incremental():
+            self.stopAt(num)
+            return False
+        # A page that isn't full is the last one
+        return len(z) >= self.pageSize
+
+    def addMedia(self, medias, kind, index):
+        """
+        Adds the media of one api page to the download list, skipping anything cached or on disk
+        :params: medias - the media of the page, kind - the latestCache section, "images" or
+        "collection", index - the DirIndex of the folder the media is saved in
+        :return: the number of files that were neither saved before nor older than
+        self.since, old collection posts count unless they were saved before
+        """
+        fresh = 0
+        for url in medias:
+            for record in self.mediaRecords(url, kind):
+                fresh += self.addMediaItem(url, record.key, record.url, kind, index)
+        return fresh
+
+    def addMediaItem(self, url, key, link, kind, index):
+        """
+        Adds one file of a media item to the download list, skipping it if it's
+        cached or on disk
+        :params: url - the media item, key - the id the file is cached and saved under,
+        link - the url the file is downloaded from, kind - the latestCache section,
+        index - the DirIndex of the folder the media is saved in
+        :return: 1 when the file counts as new for addMedia, else 0
+        """
+        global latestCache
+        self.noteListed(
+            kind,
+            key,
+            id=url.get("_id"),
+            upload_date=url["upload_date"],
+            is_video=url["is_video"],
+            url=link,
+            width=url.get("width"),
+            height=url.get("height"),
+        )
+        if self.since is not None and url["upload_date"] < self.since:
+            # Collections are ordered by when a post was collected, not uploaded,
+            # so an old upload there says nothing about the pages after it
+            if kind == "collection" and not (
+                latestCache is not None and latestCache.isSeen(self.username, kind, key)
+            ):
+                return 1
+            return 0
+        if latestCache is not None:
+            if latestCache.isSeen(self.username, kind, key):
+                self.record("skipped_cache")
+                return 0
+        if index.hasAny(key, (".jpg", ".mp4")):
+            self.record("skipped_file")
+            self.markDone(
+                kind,
+                key,
+                os.path.join(
+                    index.path, "%s%s" % (key, ".mp4" if url["is_video"] else ".jpg")
+                ),
+                existing=True,
+            )
+            return 1
+        self.enqueue([link, key, url["is_video"] is True])
+        self.pbar.update()
+        return 1
+
+    def download_img_normal(self, lists, folder=None, kind="images"):
         """
         This function makes sense at least
 
@@ -561,22 +1237,33 @@ class Scraper(object):
         and return True
 
         :params: lists - My naming sense was beat. lists is just a media item.
+        folder - where the media is saved, defaults to the user's folder,
+        kind - the latestCache section the item is recorded in once it's saved
         :return: a boolean on whether the media item was downloaded successfully
         """
+        if folder is None:
+            folder = self.folder
+        index = self.dirIndex(folder)
+        name = "%s%s" % (lists[1], ".mp4" if lists[2] else ".jpg")
         if lists[2] is False:
-            if "%s.jpg" % lists[1] in os.listdir():
-                return True
-            with open("%s.jpg" % str(lists[1]), "wb") as f:
-                f.write(requests.get(lists[0], stream=True).content)
+            if index.has("%s.jpg" % lists[1]):
+                self.record("skipped_file")
+            else:
+                self.fetchMedia(
+                    lists[0], os.path.join(folder, "%s.jpg" % str(lists[1]))
+                )
+                index.add("%s.jpg" % lists[1])
         else:
-            if "%s.mp4" % lists[1] in os.listdir():
-                return True
-            with open("%s.mp4" % str(lists[1]), "wb") as f:
-                for chunk in requests.get(lists[0], stream=True).iter_content(
-                    chunk_size=1024
-                ):
-                    if chunk:
-                        f.write(chunk)
+            if index.has("%s.mp4" % lists[1]):
+                self.record("skipped_file")
+            else:
+                self.fetchMedia(
+                    lists[0],
+                    os.path.join(folder, "%s.mp4" % str(lists[1])),
+                    resumable=True,
+                )
+                index.add("%s.mp4" % lists[1])
+        self.markDone(kind, lists[1], os.path.join(folder, name))
         return True
 
     def run_all(self):
@@ -603,56 +1290,240 @@ class Scraper(object):
         self.getProfile()
 
 
+def openStore(name):
+    """
+    Opens the sqlite store used by --cacheHit and --latest, importing the old json
+    _cache_store and _latest_cache_store files of the same name the first time
+    :params: name - the username or file name the store is named after
+    :return: the StateStore
+    """
+    store = StateStore(name + "_state.db")
+    store.importJson(name + "_cache_store", name + "_latest_cache_store")
+    return store
+
 
-def openCache(file):
+def siteUrl(username):
     """
-    This function is meant to open a cache file, and get a previously used cache of usernames
-    :params: file the filename used to store the cache
+    Builds the api url that maps a username to its site ids
+    :params: username - the user
+    :return: the url
     """
-    global cache
+    return "%s/sites?subdomain=%s" % (constants.api, username)
+
+
+def resolveSites(
+    usernames,
+    session,
+    store=None,
+    ttl=0,
+    workers=16,
+    metadata=None,
+    scheduler=None,
+    metrics=None,
+):
+    """
+    Looks up the site ids of many users at once before scraping them
+
+    Ids cached by --cacheHit are used as they are, ids the store looked up less than
+    ttl seconds ago are reused, and the rest are fetched workers at a time.
+
+    :params: usernames - the users, session - the requests session,
+    store - the StateStore lookups are kept in, or None, ttl - how long a lookup stays
+    valid in seconds, 0 to not reuse them, workers - how many lookups run at once,
+    metadata - the MetadataCache the lookups go through, or None,
+    scheduler - the Scheduler the lookups go through, or None,
+    metrics - the Metrics the lookups are counted in, as the "sites" phase, or None
+    :return: a dict of username to [site id, site collection id], or to None for the
+    users whose lookup failed
+    """
+    sites = {}
+    missing = []
+    for username in dict.fromkeys(usernames):
+        site = None
+        if cache is not None:
+            site = cache.getSite(username)
+        elif store is not None and ttl > 0:
+            site = store.getSite(username, ttl)
+        if site is not None:
+            sites[username] = site
+        else:
+            missing.append(username)
+
+    def lookup(username):
+        url = siteUrl(username)
+        retried = None
+        if metrics is not None:
+            retried = lambda: metrics.count(username, "sites", "retries")
+        began = time.monotonic()
+        if metadata is not None:
+            res = metadata.get(
+                session, url, None, constants.visituserinfo, scheduler, retried
+            )
+        elif scheduler is not None:
+            res = scheduler.call(
+                lambda: checked(session.get(url, headers=constants.visituserinfo)),
+                retried,
+            ).json()
+        else:
+            res = session.get(url, headers=constants.visituserinfo).json()
+        if metrics is not None:
+            metrics.count(username, "sites", "api_requests")
+            metrics.observe("api", time.monotonic() - began)
+        return [res["sites"][0]["id"], res["sites"][0]["site_collection_id"]]
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {executor.submit(lookup, username): username for username in missing}
+        for future in concurrent.futures.as_completed(futures):
+            username = futures[future]
+            try:
+                sites[username] = future.result()
+            except Exception as exc:
+                # Remembered, so the user isn't looked up again for every phase
+                sites[username] = None
+                if metrics is not None:
+                    metrics.count(username, "sites", "failures")
+                print("%s crashed looking up its site id %s" % (username, exc))
+                continue
+            if store is not None:
+                store.setSite(username, sites[username][0], sites[username][1])
+    return sites
+
+
+# The phases each Scraper method runs, as the checkpoint knows them
+RUN_PHASES = {
+    "getImages": ("images",),
+    "getJournal": ("journal",),
+    "getCollection": ("collection",),
+    "getProfile": ("profile",),
+    "run_all": ("images", "collection", "journal"),
+    "run_all_profile": ("images", "collection", "journal", "profile"),
+}
+
+
+def readUsernames(file):
+    """
+    Reads the usernames used by the multiple user options
+    :params: file - the text file, one username per line
+    :return: a list of usernames
+    """
+    y = []
+    with open(file, "r") as f:
+        for x in f:
+            y.append(x.replace("\n", ""))
+    return y
 
-    with open(file, "a+", encoding="utf-8") as f:
+
+def scrapeUsers(usernames, makeScraper, phase, parallel=1, sites=None):
+    """
+    Runs one phase for every username, parallel users at a time
+    :params: usernames - the users, makeScraper - builds the Scraper of a user,
+    phase - the name of the Scraper method to run, parallel - how many users at once,
+    sites - site ids already looked up by resolveSites, users it failed to look up
+    are skipped
+    :return: none
+    """
+    sites = sites or {}
+
+    def scrape(z):
+        if z in sites and sites[z] is None:
+            return
         try:
-            f.seek(0)
-            cache = json.load(f)
+            getattr(makeScraper(z, sites.get(z)), phase)()
+            print()
         except Exception:
-            cache = {}
+            print("%s crashed" % z)
 
+    with ThreadPoolExecutor(max_workers=max(parallel, 1)) as executor:
+        list(executor.map(scrape, usernames))
 
-def updateCache(file):
+
+def scrapeShard(table, makeScraper, phase, parallel=1, worker=None):
     """
-    This function is meant to update the current used cache file with any new information
-    :params: file the filename used to store the cache
+    Runs one phase for the users a LeaseTable hands out, parallel users at a time,
+    until there are none left
+    :params: table - the LeaseTable, makeScraper - builds the Scraper of a user,
+    phase - the name of the Scraper method to run, parallel - how many users at once,
+    worker - the name the leases are held under, defaults to host:pid
+    :return: none
     """
-    global cache
+    worker = worker or workerName()
+
+    def scrapeLeased():
+        while True:
+            z = table.claim(phase, worker)
+            if z is None:
+                return
+            ok = False
+            try:
+                scraper = makeScraper(z)
+                getattr(scraper, phase)()
+                print()
+                # The phases catch the failures of single files and pages, the user
+                # is handed out again for those too
+                ok = scraper.failures == 0 and scraper.listFailures == 0
+            except Exception:
+                print("%s crashed" % z)
+            table.finish(phase, z, worker, ok)
 
-    with open(file, "w", encoding="utf-8") as f:
-        json.dump(cache, f, ensure_ascii=False, indent=4)
+    stopped = table.heartbeat(worker)
+    try:
+        with ThreadPoolExecutor(max_workers=max(parallel, 1)) as executor:
+            for future in [
+                executor.submit(scrapeLeased) for _ in range(max(parallel, 1))
+            ]:
+                future.result()
+    finally:
+        stopped.set()
 
 
-def openLatestCache(file):
+def shardProcess(argv):
     """
-    This function is meant to open a cache for previously downloaded media
-    :params: file the filename used to store the cache
+    Runs the same command as a --processes worker, in a process of its own
+    :params: argv - the command line of the worker
+    :return: none
     """
-    global latestCache
+    sys.argv = argv
+    main()
 
-    with open(file, "a+", encoding="utf-8") as f:
-        try:
-            f.seek(0)
-            latestCache = json.load(f)
-        except Exception:
-            latestCache = {}
+
+def spawnWorkers(count):
+    """
+    Starts --processes workers next to this one, each taking users from the lease table
+    :params: count - how many processes to start
+    :return: the started processes
+    """
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for number in range(1, count + 1):
+        worker = context.Process(
+            target=shardProcess, args=(sys.argv + ["--shardChild", str(number)],)
+        )
+        worker.start()
+        workers.append(worker)
+    return workers
 
 
-def updateLatestCache(file):
+def numbered(path, number):
     """
-    This function will update the latest cache with more information
-    :params: file the filename used to store the cache
+    Gives each worker process its own copy of an output file
+    :params: path - the file, number - the worker
+    :return: the path with the number before the extension
     """
-    global latestCache
-    with open(file, "w", encoding="utf-8") as f:
-        json.dump(latestCache, f, ensure_ascii=False, indent=4)
+    stem, ext = os.path.splitext(path)
+    return "%s.%d%s" % (stem, number, ext)
+
+
+def sinceDate(value):
+    """
+    Parses the --since option
+    :params: value - a date written as YYYY-MM-DD
+    :return: the start of that day as a millisecond timestamp, like upload_date
+    """
+    try:
+        return int(datetime.strptime(value, "%Y-%m-%d").timestamp() * 1000)
+    except ValueError:
+        raise argparse.ArgumentTypeError("%r is not a YYYY-MM-DD date" % value)
+
 
 def parser():
     """Returns the parser arguments
@@ -736,142 +1607,615 @@ def parser():
         action="store_true",
         help="Only downloads media one time, and makes sure to cache the media",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "-sn",
+        "--since",
+        type=sinceDate,
+        help="Only grabs images and collection posts uploaded on or after this YYYY-MM-DD date",
+    )
+    parser.add_argument(
+        "-ps",
+        "--pageSize",
+        type=int,
+        default=100,
+        help="Number of media asked for per listing request",
+    )
+    parser.add_argument(
+        "-lw",
+        "--listWorkers",
+        type=int,
+        default=5,
+        help="Number of listing pages fetched at the same time",
+    )
+    parser.add_argument(
+        "-ttl",
+        "--siteTTL",
+        type=float,
+        default=0,
+        help="Hours a site id looked up for the multiple user options is kept in the state file and reused, 0 (default) to always look up",
+    )
+    parser.add_argument(
+        "-rw",
+        "--resolveWorkers",
+        type=int,
+        default=16,
+        help="Number of site ids looked up at the same time for the multiple user options",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=5,
+        help="Number of concurrent downloads, also the size of the connection pool",
+    )
+    parser.add_argument(
+        "-b",
+        "--bufferSize",
+        type=int,
+        default=1024,
+        help="Size in KiB of the buffer media is streamed to disk with",
+    )
+    parser.add_argument(
+        "-sg",
+        "--segments",
+        type=int,
+        default=1,
+        help="Splits large videos into this many byte ranges downloaded at once",
+    )
+    parser.add_argument(
+        "-st",
+        "--segmentThreshold",
+        type=int,
+        default=64,
+        help="Size in MiB a video must reach before it is split into segments",
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        choices=["threads", "async"],
+        default="threads",
+        help="Runs the scraper on thread pools, or on one asyncio event loop (needs aiohttp)",
+    )
+    parser.add_argument(
+        "-cc",
+        "--concurrency",
+        type=int,
+        default=100,
+        help="Maximum number of requests in flight with the async engine",
+    )
+    parser.add_argument(
+        "-pu",
+        "--parallelUsers",
+        type=int,
+        default=1,
+        help="Number of users scraped at the same time with the multiple user options",
+    )
+    parser.add_argument(
+        "-mt",
+        "--maxTransfers",
+        type=int,
+        default=0,
+        help="Caps the downloads in flight across all users, 0 for no cap",
+    )
+    parser.add_argument(
+        "-bw",
+        "--bandwidth",
+        type=float,
+        default=0,
+        help="Caps the download rate in MiB/s across all users and --processes, 0 for no cap",
+    )
+    parser.add_argument(
+        "-sm",
+        "--smallSlots",
+        type=int,
+        default=1,
+        help="Download workers of each user kept for images and text while videos download",
+    )
+    parser.add_argument(
+        "-sto",
+        "--storage",
+        choices=STORAGES,
+        default="files",
+        help="Saves media as loose files, or appends it to size-capped tar shards per user",
+    )
+    parser.add_argument(
+        "-as",
+        "--archiveSize",
+        type=int,
+        default=1024,
+        help="Size in MiB a tar shard of --storage tar is capped at",
+    )
+    parser.add_argument(
+        "-va",
+        "--variants",
+        type=int,
+        nargs="+",
+        default=[ORIGINAL],
+        help="Widths in pixels images are saved in, 0 for the original, e.g. -va 1024 or -va 0 1024",
+    )
+    parser.add_argument(
+        "-mxc",
+        "--maxConcurrency",
+        type=int,
+        default=0,
+        help="Most requests the adaptive scheduler lets run at once, 0 to follow the worker counts or --concurrency",
+    )
+    parser.add_argument(
+        "-rl",
+        "--rateLimit",
+        type=float,
+        default=0,
+        help="Most requests started per second, 0 for no limit",
+    )
+    parser.add_argument(
+        "-rt",
+        "--retries",
+        type=int,
+        default=3,
+        help="Times a failed request is retried, after a jittered backoff or Retry-After",
+    )
+    parser.add_argument(
+        "-mo",
+        "--metrics",
+        help="Json file the request, byte, skip, failure and retry counts of each user and phase are written to",
+    )
+    parser.add_argument(
+        "-pm",
+        "--prometheus",
+        help="Prometheus textfile the same numbers and the latency histograms are written to",
+    )
+    parser.add_argument(
+        "-mi",
+        "--metricsInterval",
+        type=float,
+        default=60,
+        help="Seconds between metrics writes during the run, 0 to only write them at the end",
+    )
+    parser.add_argument(
+        "-mdc",
+        "--metadataCache",
+        help="Sqlite file api responses are cached in, revalidated with ETag/Last-Modified",
+    )
+    parser.add_argument(
+        "-mds",
+        "--metadataCacheSize",
+        type=int,
+        default=256,
+        help="Size in MiB the metadata cache is trimmed to, least recently used first",
+    )
+    parser.add_argument(
+        "-cp",
+        "--checkpoint",
+        help="Sqlite file the progress of the run is kept in, running the same command again resumes where it stopped",
+    )
+    parser.add_argument(
+        "-mf",
+        "--manifest",
+        action="store_true",
+        help="Appends every media record listed and saved to manifest.jsonl in the user's folder",
+    )
+    parser.add_argument(
+        "-tm",
+        "--trustManifest",
+        action="store_true",
+        help="Keeps the manifest and skips files it says were saved instead of scanning the folders",
+    )
+    parser.add_argument(
+        "-ds",
+        "--dedupStore",
+        help="Directory every media file is kept in once, by the hash of its bytes, with the usual paths linked to it",
+    )
+    parser.add_argument(
+        "-dk",
+        "--dedupLink",
+        choices=LINKS,
+        default="hard",
+        help="How paths are linked to the dedup store: hardlinks, copy-on-write reflinks or symlinks",
+    )
+    parser.add_argument(
+        "-cs",
+        "--connectionStats",
+        action="store_true",
+        help="Prints how many requests reused an open connection",
+    )
+    parser.add_argument(
+        "-sh",
+        "--shard",
+        help="Sqlite lease table on storage every worker can reach, the multiple user options take their users from it one at a time",
+    )
+    parser.add_argument(
+        "-pr",
+        "--processes",
+        type=int,
+        default=1,
+        help="Worker processes started on this host with --shard, this one included",
+    )
+    parser.add_argument(
+        "-ls",
+        "--lease",
+        type=float,
+        default=300,
+        help="Seconds a worker holds a user without renewing it before another worker may take it over",
+    )
+    parser.add_argument(
+        "-ss",
+        "--shardStatus",
+        action="store_true",
+        help="Prints the progress of the --shard run across every worker and exits",
+    )
+    parser.add_argument(
+        "-sr",
+        "--shardReset",
+        action="store_true",
+        help="Starts the --shard run over, with every user pending again",
+    )
+    parser.add_argument("--shardChild", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.pageSize < 1:
+        parser.error("--pageSize must be at least 1")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.listWorkers < 1:
+        parser.error("--listWorkers must be at least 1")
+    if args.resolveWorkers < 1:
+        parser.error("--resolveWorkers must be at least 1")
+    if args.engine == "async" and args.segments > 1:
+        parser.error("--segments is only supported by the threads engine")
+    if args.processes < 1:
+        parser.error("--processes must be at least 1")
+    if args.bandwidth < 0 or args.smallSlots < 0:
+        parser.error("--bandwidth and --smallSlots can't be negative")
+    if args.archiveSize < 1:
+        parser.error("--archiveSize must be at least 1")
+    if any(width < 0 for width in args.variants):
+        parser.error("--variants can't be negative")
+    # Each width is saved once, in the order asked for
+    args.variants = list(dict.fromkeys(args.variants))
+    if (args.processes > 1 or args.shardStatus or args.shardReset) and not args.shard:
+        parser.error("--processes, --shardStatus and --shardReset need --shard")
+    return args
+
+def poolSize(args):
+    """
+    Works out how many connections the shared session needs to keep open, so that
+    parallel users don't throw away connections the pool has no room for
+    :params: args - the parsed arguments
+    :return: the pool size
+    """
+    users = max(args.parallelUsers, 1)
+    transfers = args.workers * users
+    if args.maxTransfers:
+        transfers = min(transfers, args.maxTransfers)
+    size = transfers * max(args.segments, 1) + args.listWorkers * users
+    return max(size, args.resolveWorkers)
+
+
+def runScrapes(
+    args,
+    makeScraper,
+    session,
+    store=None,
+    metadata=None,
+    scheduler=None,
+    metrics=None,
+    checkpoint=None,
+    shard=None,
+):
+    """
+    Runs every scrape asked for on the command line
+    :params: args - the parsed arguments, makeScraper - builds the Scraper of a user,
+    session - the shared requests session, store - the StateStore site lookups are kept in,
+    metadata - the MetadataCache api responses go through, scheduler - the shared Scheduler,
+    metrics - the Metrics of the run, or None, checkpoint - the Checkpoint of the run,
+    users whose phases it has as done are skipped,
+    shard - the LeaseTable the multiple user options take their users from, or None
+    :return: none
+    """
+    # One Scraper serves every phase asked for, so the site id is looked up once
+    if any(
+        (
+            args.siteId,
+            args.getImages,
+            args.getJournal,
+            args.getCollection,
+            args.getProfilePicture,
+        )
+    ):
+        scraper = makeScraper(args.username)
+
+    if args.siteId:
+        print(scraper.resolveSite())
+
+    for enabled, phase in (
+        (args.getImages, "getImages"),
+        (args.getJournal, "getJournal"),
+        (args.getCollection, "getCollection"),
+        (args.getProfilePicture, "getProfile"),
+    ):
+        if enabled:
+            getattr(scraper, phase)()
+
+    usernames = None
+    sites = {}
+    for enabled, phase in (
+        (args.multiple, "getImages"),
+        (args.multipleJournal, "getJournal"),
+        (args.multipleCollection, "getCollection"),
+        (args.multipleProfile, "getProfile"),
+        (args.all, "run_all"),
+        (args.allProfile, "run_all_profile"),
+    ):
+        if enabled:
+            if usernames is None:
+                usernames = readUsernames(args.username)
+            todo = usernames
+            if checkpoint is not None:
+                todo = checkpoint.pendingUsers(usernames, RUN_PHASES[phase])
+            if shard is not None:
+                # Every worker looks its leased users up itself
+                shard.load(phase, todo)
+                scrapeShard(shard, makeScraper, phase, args.parallelUsers)
+                continue
+            unresolved = [username for username in todo if username not in sites]
+            if unresolved:
+                sites.update(
+                    resolveSites(
+                        unresolved,
+                        session,
+                        store,
+                        args.siteTTL * 3600,
+                        args.resolveWorkers,
+                        metadata,
+                        scheduler,
+                        metrics,
+                    )
+                )
+            scrapeUsers(todo, makeScraper, phase, args.parallelUsers, sites)
+
+
+def runKey(args, where=True):
+    """
+    Names a run by what it scrapes and where, so the same command finds its checkpoint again
+    :params: args - the parsed arguments, where - include the working directory, left
+    out for lease tables shared by hosts
+    :return: a json string
+    """
+    what = {
+        key: getattr(args, key)
+        for key in (
+            "username",
+            "getImages",
+            "getJournal",
+            "getCollection",
+            "getProfilePicture",
+            "multiple",
+            "multipleJournal",
+            "multipleCollection",
+            "multipleProfile",
+            "all",
+            "allProfile",
+            "since",
+        )
+    }
+    if args.variants != [ORIGINAL]:
+        # Other widths are other files, runs of the originals keep their old key
+        what["variants"] = args.variants
+    if where:
+        what["folder"] = os.getcwd()
+    return json.dumps(what, sort_keys=True)
+
 
 def main():
     global cache
     global latestCache
     args = parser()
-    vsco = os.getcwd()
     cache = None
     latestCache = None
+    store = None
+    shard = None
+    if args.shard:
+        shard = LeaseTable(args.shard, runKey(args, where=False), args.lease)
+        if args.shardStatus:
+            print(json.dumps(shard.summary(), indent=4))
+            shard.close()
+            return
+        if args.shardReset and not args.shardChild:
+            shard.reset()
+    if args.shardChild:
+        # Every worker process writes its own metrics
+        if args.metrics:
+            args.metrics = numbered(args.metrics, args.shardChild)
+        if args.prometheus:
+            args.prometheus = numbered(args.prometheus, args.shardChild)
+    multiple = any(
+        (
+            args.multiple,
+            args.multipleJournal,
+            args.multipleCollection,
+            args.multipleProfile,
+            args.all,
+            args.allProfile,
+        )
+    )
+    # With --siteTTL, list modes also keep their site lookups in the store
+    if args.latest or args.cacheHit or (multiple and args.siteTTL > 0):
+        store = openStore(args.username)
+        if args.cacheHit:
+            cache = store
+        if args.latest:
+            latestCache = store
+    session = network.makeSession(poolSize(args))
+    # Async runs are capped by --concurrency, thread runs by the threads making requests
+    ceiling = args.maxConcurrency
+    if not ceiling:
+        ceiling = args.concurrency if args.engine == "async" else poolSize(args)
+    scheduler = Scheduler(ceiling, rate=args.rateLimit, retries=args.retries)
+    mediaStore = None
+    if args.dedupStore:
+        mediaStore = MediaStore(args.dedupStore, args.dedupLink)
+    bandwidth = None
+    if args.bandwidth:
+        # Every --shard process holds an equal share of the cap
+        bandwidth = Bandwidth(args.bandwidth * 1024 * 1024 / args.processes)
+    downloader = Downloader(
+        session,
+        args.bufferSize * 1024,
+        args.segments,
+        args.segmentThreshold * 1024 * 1024,
+        args.maxTransfers,
+        scheduler,
+        mediaStore,
+        bandwidth,
+    )
 
-    if args.latest:
-        openLatestCache(args.username + "_latest_cache_store")
+    checkpoint = None
+    if args.checkpoint:
+        checkpoint = Checkpoint(args.checkpoint, runKey(args))
 
-    if args.cacheHit:
-        openCache(args.username + "_cache_store")
+    metrics = None
+    if args.metrics or args.prometheus:
+        metrics = Metrics(args.metrics, args.prometheus)
+        metrics.start(args.metricsInterval)
 
-    if args.siteId:
-        scraper = Scraper(args.username)
-        print(scraper.newSiteId())
-        os.chdir(vsco)
-
-    if args.getImages:
-        scraper = Scraper(args.username)
-        scraper.getImages()
-        os.chdir(vsco)
-
-    if args.getJournal:
-        scraper = Scraper(args.username)
-        scraper.getJournal()
-        os.chdir(vsco)
-
-    if args.getCollection:
-        scraper = Scraper(args.username)
-        scraper.getCollection()
-        os.chdir(vsco)
-    
-    if args.getProfilePicture:
-        scraper = Scraper(args.username)
-        scraper.getProfile()
-        os.chdir(vsco)
-
-    if args.multiple:
-        y = []
-        with open(args.username, "r") as f:
-            for x in f:
-                y.append(x.replace("\n", ""))
-        for z in y:
-            try:
-                os.chdir(vsco)
-                Scraper(z).getImages()
-                print()
-            except:
-                print("%s crashed" % z)
-                pass
-        os.chdir(vsco)
-
-    if args.multipleJournal:
-        y = []
-        with open(args.username, "r") as f:
-            for x in f:
-                y.append(x.replace("\n", ""))
-        for z in y:
-            try:
-                os.chdir(vsco)
-                Scraper(z).getJournal()
-                print()
-            except:
-                print("%s crashed" % z)
-                pass
-        os.chdir(vsco)
-
-    if args.multipleCollection:
-        y = []
-        with open(args.username, "r") as f:
-            for x in f:
-                y.append(x.replace("\n", ""))
-        for z in y:
-            try:
-                os.chdir(vsco)
-                Scraper(z).getCollection()
-                print()
-            except:
-                print("%s crashed" % z)
-                pass
-        os.chdir(vsco)
-    
-    if args.multipleProfile:
-        y = []
-        with open(args.username, "r") as f:
-            for x in f:
-                y.append(x.replace("\n", ""))
-        for z in y:
-            try:
-                os.chdir(vsco)
-                Scraper(z).getProfile()
-                print()
-            except:
-                print("%s crashed" % z)
-                pass
-        os.chdir(vsco)
-
-    if args.all:
-        y = []
-        with open(args.username, "r") as f:
-            for x in f:
-                y.append(x.replace("\n", ""))
-        for z in y:
-            try:
-                os.chdir(vsco)
-                Scraper(z).run_all()
-                print()
-            except:
-                print("%s crashed" % z)
-                pass
-        os.chdir(vsco)
-    
-    if args.allProfile:
-        y = []
-        with open(args.username, "r") as f:
-            for x in f:
-                y.append(x.replace("\n", ""))
-        for z in y:
-            try:
-                os.chdir(vsco)
-                Scraper(z).run_all_profile()
-                print()
-            except:
-                print("%s crashed" % z)
-                pass
-        os.chdir(vsco)
+    metadata = None
+    if args.metadataCache:
+        metadata = MetadataCache(
+            args.metadataCache, args.metadataCacheSize * 1024 * 1024
+        )
+    options = {
+        "metadata": metadata,
+        "since": args.since,
+        "page_size": args.pageSize,
+        "list_workers": args.listWorkers,
+        "scheduler": scheduler,
+        "metrics": metrics,
+        "manifest": args.manifest,
+        "trust_manifest": args.trustManifest,
+        "checkpoint": checkpoint,
+        "small_slots": args.smallSlots,
+        "variants": tuple(args.variants),
+        "storage": args.storage,
+        "archive_size": args.archiveSize * 1024 * 1024,
+    }
+
+    def makeScraper(username, site=None):
+        if args.engine == "async":
+            from .asyncengine import AsyncScraper
+
+            return AsyncScraper(
+                username, args.concurrency, session, downloader, site=site, **options
+            )
+        return Scraper(
+            username, args.workers, session, downloader, site=site, **options
+        )
 
-    if args.cacheHit:
-        updateCache(args.username + "_cache_store")
+    children = []
+    if shard is not None and not args.shardChild:
+        children = spawnWorkers(args.processes - 1)
+    try:
+        runScrapes(
+            args,
+            makeScraper,
+            session,
+            store,
+            metadata,
+            scheduler,
+            metrics,
+            checkpoint,
+            shard,
+        )
+        for child in children:
+            child.join()
+        # The checkpoint only resumes interrupted runs. One that got to the end, users
+        # that can never finish included, starts over the next time
+        if (
+            checkpoint is not None
+            and not args.shardChild
+            and all(child.exitcode == 0 for child in children)
+        ):
+            checkpoint.clear()
+    finally:
+        if shard is not None:
+            if children:
+                summary = shard.summary()
+                for phase, counts in sorted(summary["phases"].items()):
+                    print(
+                        "%s: %d users done, %d failed, %d left, over %d workers"
+                        % (
+                            phase,
+                            counts["done"],
+                            counts["failed"],
+                            counts["pending"] + counts["leased"],
+                            len(summary["workers"]),
+                        )
+                    )
+            shard.close()
+        if checkpoint is not None:
+            checkpoint.close()
+        if metrics is not None:
+            metrics.stop()
+        if store is not None:
+            store.close()
+        if metadata is not None:
+            metadata.close()
+        if mediaStore is not None:
+            mediaStore.close()
+
+    if metadata is not None:
+        print(
+            "Metadata cache: %d hits, %d misses, %d evicted"
+            % (
+                metadata.stats["hits"],
+                metadata.stats["misses"],
+                metadata.stats["evicted"],
+            )
+        )
 
-    if args.latest:
-        updateLatestCache(args.username + "_latest_cache_store")
+    if mediaStore is not None:
+        print(
+            "Media store: %d files stored, %d linked without downloading, "
+            "%d duplicates dropped, %d bytes saved"
+            % (
+                mediaStore.stats["stored"],
+                mediaStore.stats["linked"],
+                mediaStore.stats["duplicates"],
+                mediaStore.stats["bytes_saved"],
+            )
+        )
+
+    if args.connectionStats:
+        stats = network.connectionStats(session)
+        print(
+            "%d requests over %d connections, %d reused"
+            % (stats["requests"], stats["connections"], stats["reused"])
+        )
+
+    summary = scheduler.summary()
+    print(
+        "%d requests, %d retried, %d failed, %d throttled, concurrency %.1f on average, "
+        "%d at peak, limit %d at the end"
+        % (
+            summary["requests"],
+            summary["retries"],
+            summary["failures"],
+            summary["throttled"],
+            summary["average"],
+            summary["peak"],
+            summary["limit"],
+        )
+    )
+
+    if downloader.stats["resumed"] or downloader.stats["restarted"]:
+        print(
+            "Resumed %d videos, saving %d bytes, %d had to restart"
+            % (
+                downloader.stats["resumed"],
+                downloader.stats["bytes_saved"],
+                downloader.stats["restarted"],
+            )
+        )
 
 
 if __name__ == "__main__":
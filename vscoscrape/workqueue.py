@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# This file holds the download queues that hand out the smallest expected work first
+import asyncio
+import heapq
+import itertools
+import threading
+
+# Expected sizes in bytes of the media a listing finds, nothing says more before the download
+IMAGE_BYTES = 512 * 1024
+VIDEO_BYTES = 16 * 1024 * 1024
+# Work up to this size counts as small, reserved workers only take small work
+SMALL_BYTES = 4 * 1024 * 1024
+
+
+class WorkQueue(object):
+    """
+    A bounded queue for threads that hands out the item with the smallest expected
+    size first, and the oldest of those on a tie
+
+    put blocks while maxsize items are waiting. get(small_only=True) only takes items
+    up to small bytes, so a few workers stay free for images while videos run. get
+    returns None once close was called and there is nothing left it may take.
+    """
+
+    def __init__(self, maxsize=0, small=SMALL_BYTES):
+        self.maxsize = maxsize
+        self.small = small
+        self.heap = []
+        self.order = itertools.count()
+        self.closed = False
+        self.changed = threading.Condition()
+
+    def put(self, item, size):
+        """
+        Adds an item, waiting while the queue is full
+        :params: item - the work, size - its expected size in bytes
+        :return: none
+        """
+        with self.changed:
+            while self.maxsize and len(self.heap) >= self.maxsize:
+                self.changed.wait()
+            heapq.heappush(self.heap, (size, next(self.order), item))
+            self.changed.notify_all()
+
+    def get(self, small_only=False):
+        """
+        Takes the smallest item, waiting until there is one
+        :params: small_only - only take items up to self.small bytes
+        :return: the item, or None once the queue is closed and has nothing left
+        """
+        with self.changed:
+            while True:
+                if self.heap and (not small_only or self.heap[0][0] <= self.small):
+                    item = heapq.heappop(self.heap)[2]
+                    self.changed.notify_all()
+                    return item
+                if self.closed:
+                    return None
+                self.changed.wait()
+
+    def close(self):
+        """
+        Tells the workers no more items are coming, they finish what is queued
+        :params: none
+        :return: none
+        """
+        with self.changed:
+            self.closed = True
+            self.changed.notify_all()
+
+
+class AsyncWorkQueue(object):
+    """
+    WorkQueue for coroutines on one event loop
+    """
+
+    def __init__(self, maxsize=0, small=SMALL_BYTES):
+        self.maxsize = maxsize
+        self.small = small
+        self.heap = []
+        self.order = itertools.count()
+        self.closed = False
+        self.changed = asyncio.Condition()
+
+    async def put(self, item, size):
+        """
+        Adds an item, waiting while the queue is full
+        :params: item - the work, size - its expected size in bytes
+        :return: none
+        """
+        async with self.changed:
+            while self.maxsize and len(self.heap) >= self.maxsize:
+                await self.changed.wait()
+            heapq.heappush(self.heap, (size, next(self.order), item))
+            self.changed.notify_all()
+
+    async def get(self, small_only=False):
+        """
+        Takes the smallest item, waiting until there is one
+        :params: small_only - only take items up to self.small bytes
+        :return: the item, or None once the queue is closed and has nothing left
+        """
+        async with self.changed:
+            while True:
+                if self.heap and (not small_only or self.heap[0][0] <= self.small):
+                    item = heapq.heappop(self.heap)[2]
+                    self.changed.notify_all()
+                    return item
+                if self.closed:
+                    return None
+                await self.changed.wait()
+
+    async def close(self):
+        """
+        Tells the workers no more items are coming, they finish what is queued
+        :params: none
+        :return: none
+        """
+        async with self.changed:
+            self.closed = True
+            self.changed.notify_all()